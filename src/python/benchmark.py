@@ -0,0 +1,427 @@
+from os import path, makedirs, cpu_count
+from time import time
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import matplotlib.pyplot as plt
+import cv2
+from numba import config
+
+from utils import get_random_points, create_initial_image
+from solvers import (
+    Solver,
+    JacobiSolver,
+    SuccessiveOverRelaxationSolver,
+    ConjugateGradientSolver,
+    MultigridSolver,
+    DirectSolver,
+)
+
+SOLVERS = {
+    'jacobi': (JacobiSolver, {}),
+    'sor': (SuccessiveOverRelaxationSolver, {'omega': 1.7}),
+    'conjugate_gradient': (ConjugateGradientSolver, {}),
+    'multigrid': (MultigridSolver, {}),
+}
+
+
+def main():
+    np.random.seed(42)
+    print('Preparing data.')
+
+    image = (
+        plt.imread(
+            path.join(
+                path.dirname(__file__), '..', '..', 'public', 'images', 'baboon.jpg'
+            )
+        )
+        / 255.0
+    )
+
+    images = {
+        512: image,
+        2048: cv2.resize(image, (2048, 2048)),
+    }
+
+    points_random = {
+        size: get_random_points((size, size), 0.1) for size in images.keys()
+    }
+
+    print('Benchmark started.')
+
+    bench_threads = True
+    bench_fused = True
+    bench_branchless = True
+    bench_sparse = True
+    bench_split = True
+    bench_tiled = True
+    bench_concurrent = True
+    bench_direct = True
+    bench_precision = True
+
+    if bench_threads:
+        benchmark_threads(images[2048], points_random[2048])
+    if bench_fused:
+        benchmark_fused(images[2048], points_random[2048])
+    if bench_branchless:
+        benchmark_branchless(images[2048], points_random[2048])
+    if bench_sparse:
+        benchmark_sparse(images[512])
+    if bench_split:
+        benchmark_split(images[2048], points_random[2048])
+    if bench_tiled:
+        benchmark_tiled(images[2048], points_random[2048])
+    if bench_concurrent:
+        benchmark_concurrent(cv2.resize(image, (256, 256)))
+    if bench_direct:
+        benchmark_direct(images[512], points_random[512])
+    if bench_precision:
+        benchmark_precision(images[512], points_random[512])
+
+
+def benchmark_threads(image, points, iters=10):
+    """Compare serial kernels with parallel ones using 1..N threads."""
+    for name, (solver_cls, kwargs) in SOLVERS.items():
+        serial_time, expected = time_iterations(
+            solver_cls(**kwargs), image, points, iters
+        )
+
+        results = []
+        for n_threads in range(1, config.NUMBA_NUM_THREADS + 1):
+            solver = solver_cls(parallel=True, n_threads=n_threads, **kwargs)
+            elapsed, result = time_iterations(solver, image, points, iters)
+            error = np.max(np.abs(result - expected))
+            results.append((n_threads, elapsed, serial_time / elapsed, error))
+
+            print(
+                f'{solver}, {n_threads} threads: {elapsed:.2f} s, '
+                f'speedup {serial_time / elapsed:.2f}, error {error:.2e}'
+            )
+
+        save_results(
+            path.join('benchmark', 'threads', f'{name}_{image.shape[0]}.csv'),
+            'threads,time,speedup,error',
+            results,
+        )
+
+
+def benchmark_fused(image, points, iters=10):
+    """Compare separate iteration and residual passes with the fused step."""
+    x_i = create_initial_image(image, points)
+    f = np.zeros_like(x_i)
+    boundary_m = Solver.boundary_mask(x_i.shape, points)
+
+    results = []
+    for name in ('jacobi', 'sor'):
+        solver_cls, kwargs = SOLVERS[name]
+        solver = solver_cls(**kwargs)
+        solver.warm_up()
+        state = solver.prepare(x_i, f, boundary_m)
+
+        start = time()
+        for _ in range(iters):
+            solver.sweep(state, f, boundary_m)
+            solver.update_residual(state, f, boundary_m)
+        separate_time = (time() - start) / iters
+
+        start = time()
+        for _ in range(iters):
+            solver.step(state, f, boundary_m)
+        fused_time = (time() - start) / iters
+
+        results.append((name, separate_time, fused_time))
+        print(
+            f'{solver}: separate {separate_time * 1e3:.1f} ms, '
+            f'fused {fused_time * 1e3:.1f} ms per iteration'
+        )
+
+    save_results(
+        path.join('benchmark', f'fused_{image.shape[0]}.csv'),
+        'solver,separate,fused',
+        results,
+    )
+
+
+def benchmark_branchless(image, points, iters=10):
+    """Compare pixel updates per second of the branching kernels and the
+    branchless ones."""
+    x_i = create_initial_image(image, points)
+    f = np.zeros_like(x_i)
+    boundary_m = Solver.boundary_mask(x_i.shape, points)
+    pixels = iters * boundary_m.size
+
+    results = []
+    for name in ('jacobi', 'sor', 'conjugate_gradient'):
+        solver_cls, kwargs = SOLVERS[name]
+
+        updates = []
+        for branchless in (False, True):
+            solver = solver_cls(branchless=branchless, **kwargs)
+            solver.warm_up()
+            state = solver.prepare(x_i, f, boundary_m)
+
+            start = time()
+            solver.sweep(state, f, boundary_m, iters)
+            updates.append(pixels / (time() - start))
+
+        results.append((name, *updates))
+        print(
+            f'{name}: {updates[0] / 1e6:.1f} -> {updates[1] / 1e6:.1f} '
+            'million pixel updates per second'
+        )
+
+    save_results(
+        path.join('benchmark', f'branchless_{image.shape[0]}.csv'),
+        'solver,branching,branchless',
+        results,
+    )
+
+
+def benchmark_sparse(image, iters=10):
+    """Compare sweep times of dense kernels and the ones iterating only over
+    pixels to solve, for different amounts of known points."""
+    results = []
+    for p in (0.1, 0.5, 0.8, 0.9, 0.95):
+        points = get_random_points(image.shape, p)
+        x_i = create_initial_image(image, points)
+        f = np.zeros_like(x_i)
+        boundary_m = Solver.boundary_mask(x_i.shape, points)
+
+        for name in ('jacobi', 'sor', 'conjugate_gradient'):
+            solver_cls, kwargs = SOLVERS[name]
+
+            times = []
+            for sparse in (False, True):
+                solver = solver_cls(sparse=sparse, **kwargs)
+                state = solver.prepare(x_i, f, boundary_m)
+                solver.sweep(state, f, boundary_m)
+
+                start = time()
+                solver.sweep(state, f, boundary_m, iters)
+                times.append((time() - start) / iters)
+
+            results.append((p, name, *times))
+            print(
+                f'{name}, {p:.0%} points: dense {times[0] * 1e3:.2f} ms, '
+                f'sparse {times[1] * 1e3:.2f} ms per iteration'
+            )
+
+    save_results(
+        path.join('benchmark', f'sparse_{image.shape[0]}.csv'),
+        'points,solver,dense,sparse',
+        results,
+    )
+
+
+def benchmark_split(image, points, iters=10):
+    """Compare SOR sweeps on the interleaved layout with the red-black split
+    one. Conversion into the split layout and back is done once per solve
+    and is measured separately."""
+    x_i = create_initial_image(image, points)
+    f = np.zeros_like(x_i)
+    boundary_m = Solver.boundary_mask(x_i.shape, points)
+    _, kwargs = SOLVERS['sor']
+
+    results = []
+    for split in (False, True):
+        solver = SuccessiveOverRelaxationSolver(split=split, **kwargs)
+        solver.warm_up()
+
+        start = time()
+        state = solver.prepare(x_i, f, boundary_m)
+        solver.finish(state)
+        conversion_time = time() - start
+
+        start = time()
+        solver.sweep(state, f, boundary_m, iters)
+        sweep_time = (time() - start) / iters
+
+        results.append((split, conversion_time, sweep_time))
+        print(
+            f'{solver}, split={split}: prepare {conversion_time * 1e3:.1f} ms, '
+            f'{sweep_time * 1e3:.1f} ms per iteration'
+        )
+
+    save_results(
+        path.join('benchmark', f'split_{image.shape[0]}.csv'),
+        'split,prepare,sweep',
+        results,
+    )
+
+
+def benchmark_tiled(image, points, iters=16):
+    """Compare time per sweep of [iters] untiled and tiled sweeps with
+    different numbers of sweeps per band of rows."""
+    x_i = create_initial_image(image, points)
+    f = np.zeros_like(x_i)
+    boundary_m = Solver.boundary_mask(x_i.shape, points)
+
+    results = []
+    for name in ('jacobi', 'sor'):
+        solver_cls, kwargs = SOLVERS[name]
+
+        for branchless in (False, True):
+            for tile_sweeps in (None, 2, 4, 8, 16):
+                solver = solver_cls(
+                    tile_sweeps=tile_sweeps, branchless=branchless, **kwargs
+                )
+                solver.warm_up()
+                state = solver.prepare(x_i, f, boundary_m)
+
+                start = time()
+                solver.sweep(state, f, boundary_m, iters)
+                elapsed = (time() - start) / iters
+
+                results.append((name, branchless, tile_sweeps, elapsed))
+                print(
+                    f'{solver}, branchless={branchless}, '
+                    f'tile_sweeps={tile_sweeps}: {elapsed * 1e3:.1f} ms per sweep'
+                )
+
+    save_results(
+        path.join('benchmark', f'tiled_{image.shape[0]}.csv'),
+        'solver,branchless,tile_sweeps,time',
+        results,
+    )
+
+
+def benchmark_concurrent(image, n_images=16):
+    """Measure throughput of a single solver instance solving [n_images]
+    problems at once from 1..N threads."""
+    problems = []
+    for _ in range(n_images):
+        points = get_random_points(image.shape, 0.1)
+        x_i = create_initial_image(image, points)
+        problems.append((x_i, np.zeros_like(x_i), points))
+
+    results = []
+    for name in ('sor', 'multigrid'):
+        solver_cls, kwargs = SOLVERS[name]
+        solver = solver_cls(**kwargs)
+        solver.warm_up()
+
+        for n_workers in range(1, cpu_count() + 1):
+            start = time()
+            with ThreadPoolExecutor(n_workers) as executor:
+                list(executor.map(lambda problem: solver.solve(*problem), problems))
+            throughput = n_images / (time() - start)
+
+            results.append((name, n_workers, throughput))
+            print(f'{solver}, {n_workers} threads: {throughput:.2f} solves per second')
+
+    save_results(
+        path.join('benchmark', f'concurrent_{image.shape[0]}.csv'),
+        'solver,threads,throughput',
+        results,
+    )
+
+
+def benchmark_direct(image, points, n_images=4):
+    """Compare the first solve of the direct solver, which factorizes the
+    matrix, with solves of other images with the same points, which reuse
+    the factorization from memory or from the cache directory."""
+    images = [image] + [np.roll(image, k, axis=(0, 1)) for k in range(1, n_images)]
+
+    results = []
+    with TemporaryDirectory() as cache_dir:
+        solver = DirectSolver(cache_dir=cache_dir)
+        solver.warm_up()
+
+        for k, image in enumerate(images):
+            x_i = create_initial_image(image, points)
+            start = time()
+            solver.solve(x_i, np.zeros_like(x_i), points)
+            results.append(('memory', k, time() - start))
+
+        solver = DirectSolver(cache_dir=cache_dir)
+        x_i = create_initial_image(image, points)
+        start = time()
+        solver.solve(x_i, np.zeros_like(x_i), points)
+        results.append(('disk', 0, time() - start))
+
+    for cache, k, elapsed in results:
+        print(f'{cache} cache, image {k}: {elapsed:.3f} s')
+
+    save_results(
+        path.join('benchmark', f'direct_{image.shape[0]}.csv'),
+        'cache,image,time',
+        results,
+    )
+
+
+def benchmark_precision(image, points, rtol_single=1e-5):
+    """Compare float64 solves with float32 ones, which stop at [rtol_single]
+    of the starting residual as float32 cannot get much further, and with
+    float32 solves refined in float64 to the tolerance of the float64 ones.
+    Error is the largest difference from the float64 solution."""
+    x_i = create_initial_image(image, points)
+    f = np.zeros_like(x_i)
+
+    results = []
+    for name in ('sor', 'conjugate_gradient', 'multigrid'):
+        solver_cls, kwargs = SOLVERS[name]
+        expected, baseline, baseline_time = None, None, None
+
+        for mode in ('float64', 'float32', 'refinement'):
+            options = {}
+            if mode != 'float64':
+                options['dtype'] = np.float32
+            if mode == 'float32':
+                options['tol'] = rtol_single * baseline[0][0]
+                options['refinement'] = False
+
+            solver = solver_cls(**kwargs, **options)
+            solver.warm_up()
+
+            start = time()
+            x, _, stats = solver.solve(x_i, f, points)
+            elapsed = time() - start
+
+            if expected is None:
+                expected, baseline, baseline_time = x, stats, elapsed
+            error = np.max(np.abs(x - expected))
+            speedup = baseline_time / elapsed
+            results.append((name, mode, len(stats) - 1, elapsed, speedup, error))
+
+            print(
+                f'{solver}, {mode}: {len(stats) - 1} iterations, {elapsed:.2f} s, '
+                f'speedup {speedup:.2f}, residual {stats[-1][0]:.2e}, '
+                f'error {error:.2e}'
+            )
+
+    save_results(
+        path.join('benchmark', f'precision_{image.shape[0]}.csv'),
+        'solver,mode,iterations,time,speedup,error',
+        results,
+    )
+
+
+def time_iterations(solver, image, points, iters):
+    """Measure time of [iters] solver iterations, not including compilation
+    of the solver's kernels."""
+    x_i = create_initial_image(image, points)
+    f = np.zeros_like(x_i)
+    boundary_m = Solver.boundary_mask(x_i.shape, points)
+    solver.warm_up()
+
+    start = time()
+    for _ in range(iters):
+        x_i = solver.iteration(x_i, f, boundary_m)
+
+    return time() - start, x_i
+
+
+def save_results(filename, header, results):
+    file_path = path.join(path.dirname(__file__), '..', '..', 'results', filename)
+    makedirs(path.dirname(file_path), exist_ok=True)
+    with open(file_path, 'wt', encoding='utf-8') as f:
+        f.write(f'{header}\n')
+        for row in results:
+            f.write(','.join(str(value) for value in row) + '\n')
+
+    print(f'Saved {filename}')
+
+
+if __name__ == '__main__':
+    main()
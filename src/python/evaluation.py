@@ -12,9 +12,12 @@ from torchmetrics.image.lpip import LearnedPerceptualImagePatchSimilarity as lpi
 from utils import get_random_points, get_center_points, create_initial_image
 from solvers import (
     JacobiSolver,
+    ChebyshevJacobiSolver,
     SuccessiveOverRelaxationSolver,
     ConjugateGradientSolver,
     MultigridSolver,
+    MultigridConjugateGradientSolver,
+    AndersonSolver,
 )
 
 warnings.filterwarnings("ignore", category=UserWarning)
@@ -61,6 +64,7 @@ def main():
     eval_sor = True
     eval_conjugate_gradient = True
     eval_multigrid = True
+    eval_multigrid_conjugate_gradient = True
 
     if eval_jacobi:
         evaluate_jacobi(images, points_random, points_center)
@@ -70,10 +74,13 @@ def main():
         evaluate_conjugate_gradient(images, points_random, points_center)
     if eval_multigrid:
         evaluate_multigrid(images, points_random, points_center)
+    if eval_multigrid_conjugate_gradient:
+        evaluate_multigrid_conjugate_gradient(images, points_random, points_center)
 
 
 def evaluate_jacobi(images, points_random, points_center):
     eval_params, eval_boundary, eval_size, eval_sim = False, False, False, False
+    eval_chebyshev = True
 
     # Comparing parameters
     for w in np.linspace(0, 1, 7)[1:]:
@@ -121,8 +128,9 @@ def evaluate_jacobi(images, points_random, points_center):
         if not eval_size:
             break
 
-        if size in {1024, 2048}:
-            continue
+        # Large images check the residual only after tiled iterations, their
+        # stats have one row per tile_sweeps + 1 iterations
+        tiled = {'tile_sweeps': 8, 'tile_steps': True} if size >= 1024 else {}
 
         points_r = points_random[size][0.1]
         points_c = points_center[size]
@@ -133,6 +141,26 @@ def evaluate_jacobi(images, points_random, points_center):
                 points,
                 path.join('jacobi', f'size_{name}', f'jacobi_{size}_{name}.csv'),
                 **({} if name == '010' else {'tol': 1e-1}),
+                **tiled,
+            )
+
+    # Comparing image sizes with Chebyshev acceleration
+    for size, image in images.items():
+        if not eval_chebyshev:
+            break
+
+        points_r = points_random[size][0.1]
+        points_c = points_center[size]
+        for name, points in [('010', points_r), ('center', points_c)]:
+            evaluate_solver(
+                ChebyshevJacobiSolver,
+                image,
+                points,
+                path.join(
+                    'jacobi',
+                    f'chebyshev_{name}',
+                    f'chebyshev_jacobi_{size}_{name}.csv',
+                ),
             )
 
     if eval_sim:
@@ -155,6 +183,7 @@ def evaluate_jacobi(images, points_random, points_center):
 
 def evaluate_sor(images, points_random, points_center):
     eval_params, eval_boundary, eval_size, eval_sim = False, False, False, False
+    eval_adaptive, eval_anderson = True, True
 
     # Comparing parameters
     for o in (*np.linspace(0, 1, 7)[1:], *np.linspace(1.1, 1.9, 9)):
@@ -173,6 +202,55 @@ def evaluate_sor(images, points_random, points_center):
             omega=o,
         )
 
+    # Comparing adaptive omega with the fixed ones
+    if eval_adaptive:
+        evaluate_solver(
+            SuccessiveOverRelaxationSolver,
+            images[256],
+            points_random[256][0.1],
+            path.join('sor', 'parameters', 'sor_256_010_adaptive.csv'),
+            omega='adaptive',
+        )
+
+    for size, image in images.items():
+        if not eval_adaptive:
+            break
+
+        if size in {1024, 2048}:
+            continue
+
+        points_r = points_random[size][0.1]
+        points_c = points_center[size]
+        for name, points in [('010', points_r), ('center', points_c)]:
+            evaluate_solver(
+                SuccessiveOverRelaxationSolver,
+                image,
+                points,
+                path.join('sor', f'adaptive_{name}', f'sor_adaptive_{size}_{name}.csv'),
+                **({} if name == '010' else {'tol': 1e-1}),
+                omega='adaptive',
+            )
+
+    # Comparing image sizes with Anderson acceleration
+    for size, image in images.items():
+        if not eval_anderson:
+            break
+
+        if size in {1024, 2048}:
+            continue
+
+        points_r = points_random[size][0.1]
+        points_c = points_center[size]
+        for name, points in [('010', points_r), ('center', points_c)]:
+            evaluate_solver(
+                AndersonSolver,
+                image,
+                points,
+                path.join('sor', f'anderson_{name}', f'sor_anderson_{size}_{name}.csv'),
+                **({} if name == '010' else {'tol': 1e-1}),
+                solver=SuccessiveOverRelaxationSolver(omega=1.7),
+            )
+
     # Comparing boundary conditions
     for p, b in points_random[256].items():
         if not eval_boundary:
@@ -204,8 +282,9 @@ def evaluate_sor(images, points_random, points_center):
         if not eval_size:
             break
 
-        if size in {1024, 2048}:
-            continue
+        # Large images check the residual only after tiled iterations, their
+        # stats have one row per tile_sweeps + 1 iterations
+        tiled = {'tile_sweeps': 8, 'tile_steps': True} if size >= 1024 else {}
 
         points_r = points_random[size][0.1]
         points_c = points_center[size]
@@ -216,6 +295,7 @@ def evaluate_sor(images, points_random, points_center):
                 points,
                 path.join('sor', f'size_{name}', f'sor_{size}_{name}.csv'),
                 **({} if name == '010' else {'tol': 1e-1}),
+                **tiled,
                 omega=1.7,
             )
 
@@ -242,6 +322,7 @@ def evaluate_sor(images, points_random, points_center):
 
 def evaluate_conjugate_gradient(images, points_random, points_center):
     eval_boundary, eval_size, eval_sim = False, False, True
+    eval_preconditioner = True
 
     # Comparing boundary conditions
     for p, b in points_random[256].items():
@@ -290,6 +371,27 @@ def evaluate_conjugate_gradient(images, points_random, points_center):
                 ),
             )
 
+    # Comparing image sizes with the DCT preconditioner, whose number of
+    # iterations should barely grow with the image size
+    for size, image in images.items():
+        if not eval_preconditioner:
+            break
+
+        points_r = points_random[size][0.1]
+        points_c = points_center[size]
+        for name, points in [('010', points_r), ('center', points_c)]:
+            evaluate_solver(
+                ConjugateGradientSolver,
+                image,
+                points,
+                path.join(
+                    'conjugate_gradient',
+                    f'preconditioner_{name}',
+                    f'conjugate_gradient_dct_{size}_{name}.csv',
+                ),
+                preconditioner='dct',
+            )
+
     # Evaluate image similarity
     if eval_sim:
         evaluate_similarity(
@@ -316,6 +418,7 @@ def evaluate_conjugate_gradient(images, points_random, points_center):
 
 def evaluate_multigrid(images, points_random, points_center):
     eval_params, eval_boundary, eval_size, eval_sim = False, False, False, True
+    eval_cycles, eval_schedule, eval_shape = True, True, True
 
     # Comparing parameters
     for n_smooth in np.linspace(10, 50, 5):
@@ -332,33 +435,115 @@ def evaluate_multigrid(images, points_random, points_center):
                 f'multigrid_256_010_{int(n_smooth)}.csv',
             ),
             n_smooth=n_smooth,
-            eval=True,
         )
 
-    # Comparing boundary conditions
+    # Comparing boundary conditions, with and without Galerkin coarse grids
     for p, b in points_random[256].items():
         if not eval_boundary:
             break
 
-        evaluate_solver(
-            MultigridSolver,
-            images[256],
-            b,
-            path.join(
-                'multigrid',
-                'boundary',
-                f'multigrid_256_{p:.2f}.csv'.replace('.', '', 1),
-            ),
-            eval=True,
-        )
+        for galerkin in (False, True):
+            suffix = '_galerkin' if galerkin else ''
+            evaluate_solver(
+                MultigridSolver,
+                images[256],
+                b,
+                path.join(
+                    'multigrid',
+                    'boundary',
+                    f'multigrid_256_{p:.2f}{suffix}.csv'.replace('.', '', 1),
+                ),
+                galerkin=galerkin,
+            )
     else:
-        evaluate_solver(
-            MultigridSolver,
-            images[256],
-            points_center[256],
-            path.join('multigrid', 'boundary', f'multigrid_256_center.csv'),
-            eval=True,
-        )
+        for galerkin in (False, True):
+            suffix = '_galerkin' if galerkin else ''
+            evaluate_solver(
+                MultigridSolver,
+                images[256],
+                points_center[256],
+                path.join('multigrid', 'boundary', f'multigrid_256_center{suffix}.csv'),
+                galerkin=galerkin,
+            )
+
+    # Comparing cycle types, stats contain iterations and time to tolerance
+    for cycle in ('V', 'W', 'F'):
+        if not eval_cycles:
+            break
+
+        points_r = points_random[256]
+        points_c = points_center[256]
+        for name, points in [
+            ('001', points_r[0.01]),
+            ('010', points_r[0.1]),
+            ('center', points_c),
+        ]:
+            for fmg in (False, True):
+                suffix = '_fmg' if fmg else ''
+                evaluate_solver(
+                    MultigridSolver,
+                    images[256],
+                    points,
+                    path.join(
+                        'multigrid',
+                        'cycles',
+                        f'multigrid_256_{name}_{cycle}{suffix}.csv',
+                    ),
+                    cycle=cycle,
+                    fmg=fmg,
+                )
+
+    # Comparing per grid smoothers and smoothing iterations, time to tolerance
+    # of each schedule is summarized for every boundary condition
+    schedules = {
+        'uniform': {},
+        'light_fine': {'n_smooth': [4, 8, 16, 20]},
+        'pre_post': {'n_smooth': [2, 8, 20], 'n_post_smooth': [4, 8, 20]},
+        'gauss_seidel_fine': {
+            'smoother': [
+                SuccessiveOverRelaxationSolver(omega=1.0),
+                SuccessiveOverRelaxationSolver(omega=1.7),
+            ],
+            'n_smooth': [2, 4, 8, 20],
+        },
+        'jacobi_coarse': {
+            'smoother': [
+                SuccessiveOverRelaxationSolver(omega=1.0),
+                JacobiSolver(weight=0.8),
+            ],
+            'n_smooth': [4, 20],
+        },
+    }
+    for name, points in [
+        ('001', points_random[512][0.01]),
+        ('010', points_random[512][0.1]),
+        ('center', points_center[512]),
+    ]:
+        if not eval_schedule:
+            break
+
+        summary = []
+        for schedule, kwargs in schedules.items():
+            stats = evaluate_solver(
+                MultigridSolver,
+                images[512],
+                points,
+                path.join(
+                    'multigrid', 'schedule', f'multigrid_512_{name}_{schedule}.csv'
+                ),
+                **kwargs,
+            )
+            summary.append((schedule, len(stats) - 1, stats[-1][1]))
+
+        filename = path.join('multigrid', 'schedule', f'multigrid_512_{name}.csv')
+        file_path = path.join(path.dirname(__file__), '..', '..', 'results', filename)
+        with open(file_path, 'wt', encoding='utf-8') as f:
+            f.write('schedule,iterations,time\n')
+            for schedule, iterations, time in summary:
+                f.write(f'{schedule},{iterations},{time}\n')
+                print(f'{schedule}: {iterations} iterations, {time:.2f} s')
+
+        print(f'Saved {filename}')
 
     # Comparing image sizes
     for size, image in images.items():
@@ -378,6 +563,55 @@ def evaluate_multigrid(images, points_random, points_center):
                 path.join('multigrid', f'size_{name}', f'multigrid_{size}_{name}.csv'),
             )
 
+    # Comparing rectangular and odd image sizes at native resolution, also
+    # with smoothers lighter than the default one, which rely more on the
+    # coarse grids
+    variants = {
+        '': {},
+        '_semi': {'semi_coarsening': True},
+        '_gauss_seidel': {
+            'smoother': SuccessiveOverRelaxationSolver(omega=1.0),
+            'n_smooth': 4,
+        },
+        '_jacobi': {'smoother': JacobiSolver(weight=0.8), 'n_smooth': 4},
+        '_chebyshev': {
+            'smoother': ChebyshevJacobiSolver(interval=(0.3, 2)),
+            'n_smooth': 4,
+        },
+        '_jacobi_coarse': schedules['jacobi_coarse'],
+    }
+    for h, w in (
+        (1080, 1920),
+        (720, 1280),
+        (511, 767),
+        (97, 97),
+        (96, 96),
+        (63, 65),
+        (37, 100),
+    ):
+        if not eval_shape:
+            break
+
+        # Large frames stop coarsening early and solve the coarsest grid
+        coarsest = {'min_grid_size': 16, 'direct_solve': True} if h > 256 else {}
+        image = cv2.resize(images[512], (w, h))
+        points_r = get_random_points((h, w), 0.1)
+        points_c = get_center_points(image.shape, h // 4)
+        for name, points in [('010', points_r), ('center', points_c)]:
+            for suffix, kwargs in variants.items():
+                evaluate_solver(
+                    MultigridSolver,
+                    image,
+                    points,
+                    path.join(
+                        'multigrid',
+                        f'shape_{name}',
+                        f'multigrid_{h}x{w}_{name}{suffix}.csv',
+                    ),
+                    **coarsest,
+                    **kwargs,
+                )
+
     # Evaluate image similarity
     if eval_sim:
         evaluate_similarity(
@@ -396,8 +630,93 @@ def evaluate_multigrid(images, points_random, points_center):
         )
 
 
+def evaluate_multigrid_conjugate_gradient(images, points_random, points_center):
+    eval_boundary, eval_size, eval_sim = False, True, True
+
+    # Comparing boundary conditions
+    for p, b in points_random[256].items():
+        if not eval_boundary:
+            break
+
+        evaluate_solver(
+            MultigridConjugateGradientSolver,
+            images[256],
+            b,
+            path.join(
+                'multigrid_conjugate_gradient',
+                'boundary',
+                f'multigrid_conjugate_gradient_256_{p:.2f}.csv'.replace('.', '', 1),
+            ),
+        )
+    else:
+        evaluate_solver(
+            MultigridConjugateGradientSolver,
+            images[256],
+            points_center[256],
+            path.join(
+                'multigrid_conjugate_gradient',
+                'boundary',
+                f'multigrid_conjugate_gradient_256_center.csv',
+            ),
+        )
+
+    # Comparing image sizes with multigrid on the hard cases, which are few
+    # random points and the center, also on the larger images
+    for size, image in images.items():
+        if not eval_size:
+            break
+
+        cases = [
+            ('001', points_random[size][0.01]),
+            ('010', points_random[size][0.1]),
+            ('center', points_center[size]),
+        ]
+        methods = [
+            ('multigrid', MultigridSolver),
+            ('multigrid_conjugate_gradient', MultigridConjugateGradientSolver),
+        ]
+        for name, points in cases:
+            for method, solver_cls in methods:
+                evaluate_solver(
+                    solver_cls,
+                    image,
+                    points,
+                    path.join(
+                        'multigrid_conjugate_gradient',
+                        f'size_{name}',
+                        f'{method}_{size}_{name}.csv',
+                    ),
+                )
+
+    # Evaluate image similarity
+    if eval_sim:
+        evaluate_similarity(
+            MultigridConjugateGradientSolver,
+            images[512],
+            points_random[512][0.1],
+            path.join(
+                'multigrid_conjugate_gradient',
+                f'similarity',
+                f'multigrid_conjugate_gradient_512_010.csv',
+            ),
+            1,
+        )
+        evaluate_similarity(
+            MultigridConjugateGradientSolver,
+            images[512],
+            points_center[512],
+            path.join(
+                'multigrid_conjugate_gradient',
+                f'similarity',
+                f'multigrid_conjugate_gradient_512_center.csv',
+            ),
+            1,
+        )
+
+
 def evaluate_solver(solver_cls, image, points, filename, **kwargs):
     solver = solver_cls(**kwargs)
+    solver.warm_up()
     x_i = create_initial_image(image, points)
     _, _, stats = solver.solve(x_i, np.zeros_like(x_i), points, verbose=True)
 
@@ -409,11 +728,15 @@ def evaluate_solver(solver_cls, image, points, filename, **kwargs):
             f.write(f'{i},{residual},{time}\n')
 
     print(f'Saved {filename}')
+    return stats
 
 
 def evaluate_similarity(solver_cls, image, points, filename, save_iters, **kwargs):
-    solver = solver_cls(**kwargs)
+    # Saved images are in the (c, n, n) layout expected by torch
+    solver = solver_cls(planar=True, **kwargs)
+    solver.warm_up()
     x_i = create_initial_image(image, points)
+    x_i = np.ascontiguousarray(x_i.transpose(2, 0, 1))
     _, _, stats = solver.solve(x_i, np.zeros_like(x_i), points, True, save_iters)
 
     device = 'cuda' if torch.cuda.is_available() else 'cpu'
@@ -423,12 +746,13 @@ def evaluate_similarity(solver_cls, image, points, filename, save_iters, **kwarg
     with open(file_path, 'wt', encoding='utf-8') as f:
         f.write('iteration,residual,time,ssim,lpips\n')
 
-        target = torch.from_numpy(np.expand_dims(image, -1).T).float().to(device)
+        target = image.transpose(2, 0, 1)[np.newaxis]
+        target = torch.from_numpy(np.ascontiguousarray(target)).float().to(device)
         for i, (residual, time, im) in enumerate(stats):
             if im is None:
                 continue
 
-            pred = torch.from_numpy(np.expand_dims(im, -1).T).float().to(device)
+            pred = torch.from_numpy(im[np.newaxis]).float().to(device)
             ssim_measure = ssim(pred, target, data_range=1.0)
             lpips_measure = lpips_loss(pred, target)
 
@@ -4,9 +4,13 @@ from os import path
 from utils import get_random_points, get_center_points, create_initial_image
 from solvers import (
     JacobiSolver,
+    ChebyshevJacobiSolver,
     SuccessiveOverRelaxationSolver,
     ConjugateGradientSolver,
     MultigridSolver,
+    MultigridConjugateGradientSolver,
+    DirectSolver,
+    AndersonSolver,
 )
 
 import numpy as np
@@ -39,15 +43,24 @@ def main():
     # points = get_center_points(image.shape, image.shape[0] // 4)
     x_i = create_initial_image(image, points)
 
-    print('Compiling...')
     # solver = JacobiSolver()
+    # solver = ChebyshevJacobiSolver()
     # solver = SuccessiveOverRelaxationSolver(omega=1.7)
+    # solver = SuccessiveOverRelaxationSolver(omega='adaptive')
     # solver = ConjugateGradientSolver()
+    # solver = ConjugateGradientSolver(preconditioner='dct')
     solver = MultigridSolver()
     # solver = MultigridSolver(smoother=JacobiSolver(weight=0.67))
     # solver = MultigridSolver(
     #     smoother=ConjugateGradientSolver(save_state=False), min_grid_size=SIZE / 8
     # )
+    # solver = MultigridSolver(min_grid_size=SIZE / 8, direct_solve=True)
+    # solver = MultigridConjugateGradientSolver()
+    # solver = DirectSolver()
+    # solver = AndersonSolver(SuccessiveOverRelaxationSolver(omega=1.7))
+    # solver = MultigridSolver(dtype=np.float32)
+    print('Compiling...')
+    solver.warm_up()
     print('Done.')
 
     start = time()
@@ -1,28 +1,146 @@
+from os import path, makedirs, remove, replace
 from time import time
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from hashlib import sha256
+from tempfile import mkstemp
+from threading import Lock
 
 import numpy as np
-from numba import njit
+from scipy.fft import dctn, idctn
+from scipy.ndimage import distance_transform_edt
+from scipy.linalg import eigvalsh_tridiagonal
+from scipy.sparse import csc_matrix, csr_matrix, diags, identity
+from scipy.sparse.linalg import splu
+from numba import njit, prange, config, set_num_threads
+from numba.extending import overload
 from tqdm import tqdm
-import cv2
+
+
+def _kernel(kernel):
+    """Compile [kernel] into a serial and a multi-threaded version. Loops
+    written with prange are run in parallel only in the latter. Version
+    used by the solver is selected with Solver._kernel. Kernels release
+    the GIL, so solves can run concurrently from multiple threads.
+
+    Kernels are compiled lazily for the types they are called with and
+    cached on disk, so only the first process using them compiles them
+    (see Solver.warm_up)."""
+    options = {'cache': True, 'nogil': True}
+    return njit(**options)(kernel), njit(parallel=True, **options)(kernel)
+
+
+def _rows(branching, branchless, mask_arg):
+    """Row kernel calling [branching] when its mask argument at position
+    [mask_arg] is the boundary mask and [branchless] when it is the
+    (3, n, m) array of precomputed coefficients. Implementation is
+    selected when the calling kernel is compiled. Unlike row kernels
+    passed as arguments, this keeps kernels cacheable on disk."""
+
+    def row(*args):
+        pass
+
+    @overload(row)
+    def _row(*args):
+        if args[mask_arg].ndim == 3:
+            return lambda *args: branchless(*args)
+
+        return lambda *args: branching(*args)
+
+    return row
+
+
+def _like(a, value):
+    """Scalar [value] converted to the dtype of array [a], which keeps
+    arithmetic on float32 arrays in float32."""
+    pass
+
+
+@overload(_like)
+def _like_overload(a, value):
+    dtype = a.dtype
+    return lambda a, value: dtype(value)
+
+
+class SolverState:
+    """Buffers of a single solve. Approximation is kept padded with zeros
+    in x_pad, x is a view of its interior and residual is kept in r.
+    Solvers add their own buffers as attributes. Keeping them out of the
+    solver lets one solver run multiple solves at once."""
+
+    def __init__(self, x_pad, x, r):
+        self.x_pad = x_pad
+        self.x = x
+        self.r = r
 
 
 class Solver(ABC):
     """Abstract class for Poisson's equation (nabla^2 phi = f) solver."""
 
-    def __init__(self, tol):
-        """Set tolerance which is used for solver termination."""
-        self.tol = tol
+    # Residual reduction of each correction solve run by _refine, well above
+    # the about 1e-7 at which float32 residual stops decreasing
+    refinement_rtol = 1e-4
+    # Smallest residual reduction a float32 solve without refinement accepts
+    min_rtol = 1e-6
+    # Float32 iterations stop after this many iterations without a new
+    # smallest residual, as their residual levels off above tol
+    stagnation_iters = 20
 
-        self.residual(np.zeros((2, 2, 3)), np.zeros((2, 2, 3)), np.zeros((2, 2)))
+    def __init__(
+        self,
+        tol,
+        parallel=False,
+        n_threads=None,
+        branchless=False,
+        sparse=False,
+        planar=False,
+        dtype=np.float64,
+        refinement=None,
+    ):
+        """Set tolerance which is used for solver termination. Subclasses
+        pass their other keyword arguments to this constructor.
+
+        Parameters:
+            parallel: bool ... run kernels on multiple threads
+            n_threads: int ... number of threads used when parallel is set,
+                defaults to all threads available to Numba
+            branchless: bool ... use kernels without branches, which read
+                per pixel coefficients precomputed once per solve
+            sparse: bool ... iterate only over the list of pixels to solve
+                built once per solve, faster when most pixels are boundary
+                points
+            planar: bool ... images are passed and kept in (c, n, n) layout,
+                kernels run over one contiguous plane per channel
+            dtype: np.float64 or np.float32 ... precision of the buffers
+                the solver iterates on, float32 halves their memory traffic
+                but its residual stops decreasing at about 1e-7 of the
+                starting one
+            refinement: bool ... keep the approximation in float64 and
+                solve for its correction in dtype, which reaches tol below
+                the precision of dtype (see _refine), defaults to True when
+                dtype is not float64. Without it, tol of a float32 solve has
+                to be at least min_rtol times the starting residual norm
+        """
+        if branchless and sparse:
+            raise ValueError('Branchless and sparse kernels cannot be combined')
+
+        self.tol = tol
+        self.parallel = parallel
+        self.n_threads = config.NUMBA_NUM_THREADS if n_threads is None else n_threads
+        self.branchless = branchless
+        self.sparse = sparse
+        self.planar = planar
+        self.dtype = np.dtype(dtype)
+        self.refinement = self.dtype != np.float64 if refinement is None else refinement
 
     def solve(self, x_i, f, points, verbose=False, save=None):
         """Solve Poisson'n equation nabla^2 phi = f using boundary conditions
            in points.
 
         Parameters:
-            x_i: np.ndarray (n, n) ... starting approximation
-            f: np.ndarray (n, n)
+            x_i: np.ndarray (n, n, c) ... starting approximation, (c, n, n)
+                if planar is set
+            f: np.ndarray (n, n, c) or (c, n, n)
             points: np.ndarray (m, 2)
             verbose: bool ... show progress in the terminal
             save: int ... save intermediate x_i every [save] iterations
@@ -30,40 +148,138 @@ class Solver(ABC):
         n ... matrix size
         m ... number of boundary conditions
         """
-        boundary_m = np.ones(x_i.shape[:2])
-        boundary_m[points[:, 0], points[:, 1]] = -1
+        boundary_m = self.boundary_mask(self._shape(x_i), points)
+        pbar = tqdm() if verbose else None
+        if self.refinement:
+            return self._refine(x_i, f, boundary_m, pbar, save)
 
+        x_i, f, boundary_m = (
+            a.astype(self.dtype, copy=False) for a in (x_i, f, boundary_m)
+        )
+
+        # Buffers are allocated once, iterations only update them in place
+        state = self.prepare(x_i, f, boundary_m)
+        residual = self.update_residual(state, f, boundary_m)
         residual_norm = self._residual_norm(
-            self.residual(x_i, f, boundary_m), x_i.shape[0]
+            self.dot(residual, residual), self._shape(x_i)[0]
         )
+        if self.dtype != np.float64 and self.tol < self.min_rtol * residual_norm:
+            raise ValueError(
+                f'Tolerance {self.tol} cannot be reached in {self.dtype}, '
+                'use refinement'
+            )
 
-        iteration = 0
+        stats = [(residual_norm, 0, x_i.copy() if save is not None else None)]
+        self._iterate(state, f, boundary_m, self.tol, stats, time(), pbar, save)
 
-        stats = [(residual_norm, 0, x_i if save is not None else None)]
-        start = time()
+        if len(stats) > 1:
+            residual = self.update_residual(state, f, boundary_m)
 
-        if verbose:
-            pbar = tqdm()
+        self.finish(state)
+        return state.x, residual, stats
 
-        while residual_norm > self.tol:
-            iteration += 1
-            x_i = self.iteration(x_i, f, boundary_m)
-
-            residual = self.residual(x_i, f, boundary_m)
-            residual_norm = self._residual_norm(residual, x_i.shape[0])
-            x_i_save = (
-                x_i
-                if save is not None
-                and (iteration % save == 0 or residual_norm <= self.tol)
-                else None
+    def _iterate(self, state, f, boundary_m, tol, stats, start, pbar, save, base=None):
+        """Run iterations until residual norm drops to [tol] and append
+        their residual norms, times and saved approximations to [stats].
+        Iterations in lower precision than float64 also stop when residual
+        norm stagnates. If the iterations solve for a correction of [base],
+        saved approximations are base plus the correction."""
+        residual_norm = stats[-1][0]
+        smallest, n_stagnant = residual_norm, 0
+
+        while residual_norm > tol:
+            if self.dtype != np.float64 and n_stagnant >= self.stagnation_iters:
+                break
+
+            residual_norm = self.step(state, f, boundary_m)
+            if residual_norm < smallest:
+                smallest, n_stagnant = residual_norm, 0
+            else:
+                n_stagnant += 1
+
+            save_x_i = save is not None and (
+                len(stats) % save == 0 or residual_norm <= tol
             )
+            x_i_save = None
+            if save_x_i:
+                self.finish(state)
+                x_i_save = state.x.copy() if base is None else base + state.x
             stats.append((residual_norm, time() - start, x_i_save))
 
-            if verbose:
+            if pbar is not None:
                 pbar.update()
                 pbar.set_description(f'{self}: {residual_norm:.3e} / {self.tol}')
 
-        return x_i, residual, stats
+    def _refine(self, x_i, f, boundary_m, pbar, save):
+        """Mixed precision iterative refinement. Residual of the float64
+        approximation is computed in float64 and the equation for its
+        correction nabla^2 e = r, with e = 0 on boundary points, is solved
+        in dtype until its residual drops by refinement_rtol. Adding e to
+        the approximation removes the rounding error of dtype, so the
+        rounds continue until the float64 residual reaches tol or stops
+        decreasing. Saved approximations are the float64 approximation plus
+        the correction of the current round."""
+        x = x_i.astype(np.float64)
+        f = f.astype(np.float64, copy=False)
+        boundary_m_dtype = boundary_m.astype(self.dtype)
+        n = self._shape(x)[0]
+
+        residual = self.residual(x, f, boundary_m)
+        residual_norm = self._residual_norm(self.dot(residual, residual), n)
+
+        stats = [(residual_norm, 0, x.copy() if save is not None else None)]
+        start = time()
+
+        while residual_norm > self.tol:
+            r = residual.astype(self.dtype)
+            state = self.prepare(np.zeros_like(r), r, boundary_m_dtype)
+            tol = max(self.tol, self.refinement_rtol * residual_norm)
+            self._iterate(state, r, boundary_m_dtype, tol, stats, start, pbar, save, x)
+            self.finish(state)
+
+            x += state.x
+            residual = self.residual(x, f, boundary_m)
+            previous = residual_norm
+            residual_norm = self._residual_norm(self.dot(residual, residual), n)
+            stats[-1] = (
+                residual_norm,
+                stats[-1][1],
+                x.copy() if save is not None else None,
+            )
+
+            # Correction no longer reduces the residual of the approximation
+            if residual_norm >= previous:
+                break
+
+        return x, residual, stats
+
+    def warm_up(self, n=8):
+        """Compile kernels used by the solver by running all its steps on a
+        small problem. Compiled kernels are cached on disk, so this is only
+        slow the first time, later it just loads them."""
+        x_i = np.zeros((3, n, n) if self.planar else (n, n, 3), dtype=self.dtype)
+        f = np.ones_like(x_i)
+        boundary_m = self.boundary_mask((n, n), np.array([[0, 0], [n // 2, n // 2]]))
+        boundary_m = boundary_m.astype(self.dtype)
+
+        state = self.prepare(x_i, f, boundary_m)
+        r = self.update_residual(state, f, boundary_m)
+        self.dot(r, r)
+        self.sweep(state, f, boundary_m, 2)
+        self.step(state, f, boundary_m, store_residual=True)
+        self.finish(state)
+        self.residual(state.x, f, boundary_m)
+        if self.refinement:
+            x = state.x.astype(np.float64)
+            r = self.residual(x, f.astype(np.float64), boundary_m.astype(np.float64))
+            self.dot(r, r)
+
+    @staticmethod
+    def boundary_mask(shape, points):
+        """Create mask with -1 on boundary points and 1 on pixels to solve."""
+        boundary_m = np.ones(shape[:2])
+        boundary_m[points[:, 0], points[:, 1]] = -1
+        return boundary_m
 
     def residual(self, x_i, f, boundary_m):
         """Compute Poisson's equation residual. Residual on boundary points
@@ -74,38 +290,284 @@ class Solver(ABC):
             x_{i-1}j + x_{i+1}j + x_i{j-1} + x_i{j+1} - 4 * x_ij
         ) / h^2
         """
-        return _residual(np.pad(x_i, ((1, 1), (1, 1), (0, 0))), f, boundary_m)
+        r = np.zeros_like(f)
 
-    def _residual_norm(self, r, n):
-        return np.linalg.norm(r) / n**2
+        for x_pad, f, r_plane in self._planes(self._pad(x_i), f, r):
+            self._kernel(_residual)(x_pad, f, boundary_m, r_plane)
+
+        return r
+
+    def prepare(self, x_i, f, boundary_m):
+        """Allocate buffers used by the iterations and return them as a new
+        state. Subclasses allocate their own additional buffers."""
+        x_pad = self._pad(x_i)
+        state = SolverState(x_pad, self._interior(x_pad), np.zeros_like(f))
+
+        if self.branchless:
+            state.coefficients = self._kernel(_coefficients)(boundary_m)
+        if self.sparse:
+            state.unknowns = _unknowns(boundary_m)
+
+        return state
+
+    def reset(self, state, x_i, f):
+        """Start the iterations of [state] again from x_i with right-hand
+        side f of the same shape, reusing its buffers. Subclasses also
+        reset the values they keep between sweeps."""
+        state.x[...] = x_i
+
+    def update_residual(self, state, f, boundary_m, r=None):
+        """Compute residual of the current approximation into r, or into
+        the given array."""
+        if r is None:
+            r = state.r
+
+        mask = self._mask(state, boundary_m)
+
+        for x_pad, f, r_plane in self._planes(state.x_pad, f, r):
+            if self.sparse:
+                self._kernel(_residual_sparse)(x_pad, f, state.unknowns, r_plane)
+            else:
+                self._kernel(_residual)(x_pad, f, mask, r_plane)
+
+        return r
 
-    @abstractmethod
     def iteration(self, x_i, f, boundary_m, iters=1):
+        """Run [iters] iterations starting from x_i and return the new
+        approximation."""
+        state = self.prepare(x_i, f, boundary_m)
+        self.sweep(state, f, boundary_m, iters)
+        self.finish(state)
+        return state.x
+
+    def finish(self, state):
+        """Write the current approximation into x. Solvers keeping it in a
+        different layout during the iterations override this."""
         pass
 
+    def step(self, state, f, boundary_m, store_residual=False):
+        """Run one iteration and return norm of the new residual. Residual
+        is stored into r only if store_residual is set. Solvers with a
+        kernel doing both in one pass override this."""
+        self.sweep(state, f, boundary_m)
+        r = self.update_residual(state, f, boundary_m)
+        return self._residual_norm(self.dot(r, r), self._shape(f)[0])
+
+    def dot(self, a, b):
+        """Inner product of two images."""
+        return sum(self._kernel(_dot)(a, b) for a, b in self._planes(a, b))
+
+    def _residual_norm(self, r_r, n):
+        """Scaled residual norm computed from its squared norm [r_r]."""
+        return np.sqrt(r_r) / n**2
+
+    def _shape(self, image):
+        """Height and width of [image]."""
+        return image.shape[1:] if self.planar else image.shape[:2]
+
+    def _pad(self, image):
+        """Pad [image] with zeros around its height and width."""
+        if self.planar:
+            return np.pad(image, ((0, 0), (1, 1), (1, 1)))
+
+        return np.pad(image, ((1, 1), (1, 1), (0, 0)))
+
+    def _interior(self, image_pad):
+        """View of padded [image_pad] without the padding."""
+        if self.planar:
+            return image_pad[:, 1:-1, 1:-1]
+
+        return image_pad[1:-1, 1:-1]
+
+    def _planes(self, *images):
+        """Views of [images] passed to the kernels, which index pixels as
+        [i, j, c]. Planar images are split into one (n, n, 1) view per
+        channel, so that kernels run over contiguous rows of each plane."""
+        if not self.planar:
+            return [images]
+
+        return zip(*([plane[:, :, np.newaxis] for plane in a] for a in images))
+
+    def _n_chunks(self, n_rows, min_rows=4):
+        """Number of row chunks processed in parallel by the fused and
+        tiled kernels. Each chunk has at least [min_rows] rows."""
+        if not self.parallel:
+            return 1
+
+        return max(1, min(self.n_threads, n_rows // min_rows))
+
+    def _unknown(self, boundary_m):
+        """Mask of pixels to solve, which broadcasts against images."""
+        unknown = boundary_m == 1
+        return unknown if self.planar else unknown[:, :, np.newaxis]
+
+    def _kernel(self, kernel):
+        """Select serial or parallel version of [kernel] compiled with
+        _kernel and set the number of threads it will use."""
+        if not self.parallel:
+            return kernel[0]
+
+        set_num_threads(self.n_threads)
+        return kernel[1]
+
+    @staticmethod
+    def _key(boundary_m):
+        """Hash of the shape and pixels to solve of [boundary_m]."""
+        key = sha256(np.array(boundary_m.shape, dtype=np.int64).tobytes())
+        key.update(np.packbits(boundary_m == 1).tobytes())
+        return key.hexdigest()
+
+    def _mask(self, state, boundary_m):
+        """Mask read by the row kernels, which is either the boundary mask
+        or the precomputed coefficients. Row kernels select their
+        implementation based on it."""
+        if not self.branchless:
+            return boundary_m
+
+        return state.coefficients
+
+    @abstractmethod
+    def sweep(self, state, f, boundary_m, iters=1):
+        """Run [iters] iterations in place on the buffers in [state]."""
+        pass
+
+
+@_kernel
+def _residual(x_i, f, mask, r):
+    for i in prange(f.shape[0]):
+        _residual_rows(x_i, f, mask, r, i, True)
+
+    return r
+
 
 @njit
-def _residual(x_i, f, boundary_m):
-    h = 1 / (f.shape[0] - 1)
-    r = np.zeros_like(f)
+def _residual_row(x_i, f, boundary_m, r, i, store_residual):
+    """Compute residual of row i and return its squared norm."""
+    h = _like(f, 1 / (f.shape[0] - 1))
+    n_vertical = (i > 0) + (i < f.shape[0] - 1)
+    r_r = 0.0
+
+    for j in range(f.shape[1]):
+        if boundary_m[i, j] < 1:
+            continue
+
+        n = _like(f, n_vertical + (j > 0) + (j < f.shape[1] - 1))
+
+        for c in range(f.shape[2]):
+            r_ij = (
+                f[i, j, c]
+                - (
+                    x_i[i, j + 1, c]
+                    + x_i[i + 1, j, c]
+                    + x_i[i + 1, j + 2, c]
+                    + x_i[i + 2, j + 1, c]
+                    - n * x_i[i + 1, j + 1, c]
+                )
+                / h**2
+            )
+            r_r += r_ij**2
+
+            if store_residual:
+                r[i, j, c] = r_ij
+
+    return r_r
+
 
-    for i in range(f.shape[0]):
-        n_vertical = (i > 0) + (i < f.shape[0] - 1)
+@_kernel
+def _coefficients(boundary_m):
+    """Precompute per pixel coefficients for the branchless kernels: mask
+    (1 on pixels to solve, 0 on boundary points), mask divided by the number
+    of neighbours and mask multiplied by the number of neighbours."""
+    coefficients = np.zeros(
+        (3, boundary_m.shape[0], boundary_m.shape[1]), dtype=boundary_m.dtype
+    )
 
-        for j in range(f.shape[1]):
+    for i in prange(boundary_m.shape[0]):
+        n_vertical = (i > 0) + (i < boundary_m.shape[0] - 1)
+
+        for j in range(boundary_m.shape[1]):
             if boundary_m[i, j] < 1:
                 continue
 
-            n = n_vertical + (j > 0) + (j < f.shape[1] - 1)
+            n = n_vertical + (j > 0) + (j < boundary_m.shape[1] - 1)
+            coefficients[0, i, j] = 1
+            coefficients[1, i, j] = 1 / n
+            coefficients[2, i, j] = n
+
+    return coefficients
+
+
+# Branchless kernels skip no pixels, they multiply the update by the mask
+# instead. Inputs are always finite, so fastmath is safe to use. Rows of RGB
+# images are processed with a constant number of channels, so the compiler
+# can unroll and vectorize the loop over pixels.
+@njit(fastmath=True)
+def _residual_row_branchless(x_i, f, coefficients, r, i, store_residual):
+    if f.shape[2] == 3:
+        return _residual_pixels(x_i, f, coefficients, r, i, store_residual, 3)
+    if f.shape[2] == 1:
+        return _residual_pixels(x_i, f, coefficients, r, i, store_residual, 1)
+
+    return _residual_pixels(x_i, f, coefficients, r, i, store_residual, f.shape[2])
+
+
+@njit(fastmath=True, inline='always')
+def _residual_pixels(x_i, f, coefficients, r, i, store_residual, n_channels):
+    h2 = _like(f, (1 / (f.shape[0] - 1)) ** 2)
+    up, mid, down = x_i[i], x_i[i + 1], x_i[i + 2]
+    mask, mask_n = coefficients[0, i], coefficients[2, i]
+    r_r = 0.0
+
+    for j in range(f.shape[1]):
+        for c in range(n_channels):
+            r_ij = (
+                mask[j] * f[i, j, c]
+                - (
+                    mask[j]
+                    * (up[j + 1, c] + mid[j, c] + mid[j + 2, c] + down[j + 1, c])
+                    - mask_n[j] * mid[j + 1, c]
+                )
+                / h2
+            )
+            r_r += r_ij**2
+
+            if store_residual:
+                r[i, j, c] = r_ij
+
+    return r_r
+
+
+_residual_rows = _rows(_residual_row, _residual_row_branchless, 2)
+
 
-            r[i, j] = (
-                f[i, j]
+def _unknowns(boundary_m):
+    """List pixels to solve in rows (i, j, number of neighbours)."""
+    i, j = np.nonzero(boundary_m >= 1)
+    n = (
+        (i > 0).astype(np.int64)
+        + (i < boundary_m.shape[0] - 1)
+        + (j > 0)
+        + (j < boundary_m.shape[1] - 1)
+    )
+    return np.stack((i, j, n), axis=1)
+
+
+@_kernel
+def _residual_sparse(x_i, f, unknowns, r):
+    h = _like(f, 1 / (f.shape[0] - 1))
+
+    for k in prange(unknowns.shape[0]):
+        i, j, n = unknowns[k, 0], unknowns[k, 1], _like(f, unknowns[k, 2])
+
+        for c in range(f.shape[2]):
+            r[i, j, c] = (
+                f[i, j, c]
                 - (
-                    x_i[i, j + 1]
-                    + x_i[i + 1, j]
-                    + x_i[i + 1, j + 2]
-                    + x_i[i + 2, j + 1]
-                    - n * x_i[i + 1, j + 1]
+                    x_i[i, j + 1, c]
+                    + x_i[i + 1, j, c]
+                    + x_i[i + 1, j + 2, c]
+                    + x_i[i + 2, j + 1, c]
+                    - n * x_i[i + 1, j + 1, c]
                 )
                 / h**2
             )
@@ -113,25 +575,55 @@ def _residual(x_i, f, boundary_m):
     return r
 
 
+@njit
+def _chunk(n_rows, n_chunks, k):
+    """First and last + 1 row of the k-th chunk of rows."""
+    return k * n_rows // n_chunks, (k + 1) * n_rows // n_chunks
+
+
 class JacobiSolver(Solver):
     """Poisson's equation solver implemented using Jacobi iteration."""
 
-    def __init__(self, tol=1e-11, weight=1):
+    def __init__(
+        self, tol=1e-11, weight=1, tile_sweeps=None, tile_steps=False, **kwargs
+    ):
         """Initialize Jacobi solver parameters. If weight != 1, weighted
         Jacobi iteration is used.
 
         Parameters:
             weight: float in (0, 1]
+            tile_sweeps: int ... number of sweeps done on each band of rows
+                before moving to the next one when running multiple
+                iterations, None disables tiling
+            tile_steps: bool ... each step of solve runs [tile_sweeps]
+                tiled iterations before the one computing the residual, so
+                the residual is checked every tile_sweeps + 1 iterations
         """
-        super().__init__(tol)
-        self.weight = weight
+        super().__init__(tol, **kwargs)
+        if tile_sweeps is not None and self.sparse:
+            raise ValueError('Sparse iteration cannot be tiled')
+        if tile_steps and tile_sweeps is None:
+            raise ValueError('Tiled steps need tile_sweeps')
 
-        self.iteration(np.zeros((2, 2, 3)), np.zeros((2, 2, 3)), np.zeros((2, 2)))
+        self.weight = float(weight)
+        self.tile_sweeps = tile_sweeps
+        self.tile_steps = tile_steps
 
     def __repr__(self):
         return f'JacobiSolver(weight={self.weight:.2f})'
 
-    def iteration(self, x_i, f, boundary_m, iters=1):
+    def prepare(self, x_i, f, boundary_m):
+        """Allocate second approximation buffer, iterations alternate
+        between the two."""
+        state = super().prepare(x_i, f, boundary_m)
+        state.x_pad_next = state.x_pad.copy()
+        return state
+
+    def reset(self, state, x_i, f):
+        super().reset(state, x_i, f)
+        self._interior(state.x_pad_next)[...] = x_i
+
+    def sweep(self, state, f, boundary_m, iters=1):
         """Implementation of Jacobi iteration.
 
         Update formula:
@@ -139,64 +631,605 @@ class JacobiSolver(Solver):
             x_{i-1}j_k + x_{i+1}j_k + x_i{j-1}_k + x_i{j+1}_k - h^2 * f_ij
         ) / 4 + (1 - w) * x_ij_k
         """
-        return _jacobi_iteration(
-            np.pad(x_i, ((1, 1), (1, 1), (0, 0))),
-            f,
-            boundary_m,
-            self.weight,
-            iters,
-        )
+        mask = self._mask(state, boundary_m)
+        tiled = self.tile_sweeps is not None and iters > 1
+        n_chunks = self._n_chunks(self._shape(f)[0], 2 * (self.tile_sweeps or 1))
+
+        for x_pad, x_pad_next, f in self._planes(state.x_pad, state.x_pad_next, f):
+            if self.sparse:
+                self._kernel(_jacobi_iteration_sparse)(
+                    x_pad, x_pad_next, f, state.unknowns, self.weight, iters
+                )
+            elif tiled:
+                self._kernel(_jacobi_iteration_tiled)(
+                    x_pad,
+                    x_pad_next,
+                    f,
+                    mask,
+                    self.weight,
+                    iters,
+                    self.tile_sweeps,
+                    n_chunks,
+                )
+            else:
+                self._kernel(_jacobi_iteration)(
+                    x_pad, x_pad_next, f, mask, self.weight, iters
+                )
+
+        # After an odd number of iterations result is in the second buffer
+        if iters % 2:
+            self._swap_buffers(state)
+
+    def step(self, state, f, boundary_m, store_residual=False):
+        """Jacobi iteration fused with computation of the new residual,
+        preceded by tiled iterations if tile_steps is set. Sparse iteration
+        computes the residual in a separate pass."""
+        if self.sparse:
+            return super().step(state, f, boundary_m, store_residual)
+        if self.tile_steps:
+            self.sweep(state, f, boundary_m, self.tile_sweeps)
+
+        mask = self._mask(state, boundary_m)
+        n = self._shape(f)[0]
+        r_r = 0.0
+
+        for x_pad, x_pad_next, f, r in self._planes(
+            state.x_pad, state.x_pad_next, f, state.r
+        ):
+            r_r += self._kernel(_jacobi_residual_iteration)(
+                x_pad,
+                x_pad_next,
+                f,
+                mask,
+                self.weight,
+                r,
+                store_residual,
+                self._n_chunks(n),
+            )
+        self._swap_buffers(state)
+
+        return self._residual_norm(r_r, n)
+
+    def _swap_buffers(self, state):
+        state.x_pad, state.x_pad_next = state.x_pad_next, state.x_pad
+        state.x = self._interior(state.x_pad)
+
+
+@_kernel
+def _jacobi_iteration(x_i, x_i_prime, f, mask, w, iters):
+    for _ in range(iters):
+        for i in prange(f.shape[0]):
+            _jacobi_rows(x_i, x_i_prime, f, mask, w, i)
+
+        x_i, x_i_prime = x_i_prime, x_i
+
+
+@_kernel
+def _jacobi_iteration_tiled(x_i, x_i_prime, f, mask, w, iters, tile_sweeps, n_chunks):
+    """Jacobi iteration running [tile_sweeps] sweeps at once. Sweeps move
+    over rows as a wavefront, sweep t updates row i - t right after sweep
+    t - 1 updates row i - t + 1, so only tile_sweeps + 2 rows of each
+    buffer are in use at a time and they stay in cache. Sweep t reads
+    buffer t % 2, the values it overwrites are not needed anymore, so the
+    result is the same as running sweeps one after another.
+
+    In parallel, each chunk of rows updates the part of each sweep which
+    only depends on its own rows, which shrinks by a row on every side for
+    every sweep. Rows around borders between chunks are updated afterwards
+    sweep by sweep."""
+    n_rows = f.shape[0]
+
+    for done in range(0, iters, tile_sweeps):
+        n_sweeps = min(tile_sweeps, iters - done)
+        buffers = (x_i, x_i_prime)
+
+        for k in prange(n_chunks):
+            start, end = _chunk(n_rows, n_chunks, k)
+
+            for s in range(start, end + n_sweeps - 1):
+                for t in range(n_sweeps):
+                    i = s - t
+
+                    if start + t * (k > 0) <= i < end - t * (end < n_rows):
+                        _jacobi_rows(buffers[t % 2], buffers[1 - t % 2], f, mask, w, i)
+
+        for k in prange(1, n_chunks):
+            start, _ = _chunk(n_rows, n_chunks, k)
+
+            for t in range(1, n_sweeps):
+                for i in range(start - t, start + t):
+                    _jacobi_rows(buffers[t % 2], buffers[1 - t % 2], f, mask, w, i)
+
+        if n_sweeps % 2:
+            x_i, x_i_prime = x_i_prime, x_i
+
+
+@_kernel
+def _jacobi_residual_iteration(x_i, x_i_prime, f, mask, w, r, store_residual, n_chunks):
+    """Jacobi iteration which also computes residual of the new
+    approximation and returns its squared norm. Residual of a row is
+    computed as soon as its neighbours are updated, while they are still
+    in cache. Rows are split into chunks, residual of the two rows around
+    each border between chunks is computed after all chunks are updated."""
+    n_rows = f.shape[0]
+    r_r = np.zeros(n_chunks)
+
+    for k in prange(n_chunks):
+        start, end = _chunk(n_rows, n_chunks, k)
+
+        for i in range(start, end + 1):
+            if i < end:
+                _jacobi_rows(x_i, x_i_prime, f, mask, w, i)
+
+            if start + (k > 0) <= i - 1 < end - (end < n_rows):
+                r_r[k] += _residual_rows(x_i_prime, f, mask, r, i - 1, store_residual)
+
+    r_r_borders = np.zeros(n_chunks)
+
+    for k in prange(1, n_chunks):
+        start, _ = _chunk(n_rows, n_chunks, k)
+
+        for i in range(start - 1, start + 1):
+            r_r_borders[k] += _residual_rows(x_i_prime, f, mask, r, i, store_residual)
+
+    return np.sum(r_r) + np.sum(r_r_borders)
 
 
 @njit
-def _jacobi_iteration(x_i, f, boundary_m, w, iters):
-    h = 1 / (f.shape[0] - 1)
+def _jacobi_row(x_i, x_i_prime, f, boundary_m, w, i):
+    h = _like(f, 1 / (f.shape[0] - 1))
+    w, one_minus_w = _like(f, w), _like(f, 1 - w)
+    n_vertical = (i > 0) + (i < f.shape[0] - 1)
+
+    for j in range(f.shape[1]):
+        if boundary_m[i, j] < 1:
+            continue
+
+        n = _like(f, n_vertical + (j > 0) + (j < f.shape[1] - 1))
+
+        for c in range(f.shape[2]):
+            x_i_prime[i + 1, j + 1, c] = (
+                x_i[i, j + 1, c]
+                + x_i[i + 1, j, c]
+                + x_i[i + 1, j + 2, c]
+                + x_i[i + 2, j + 1, c]
+                - h**2 * f[i, j, c]
+            ) / n * w + one_minus_w * x_i[i + 1, j + 1, c]
+
+
+@njit(fastmath=True)
+def _jacobi_row_branchless(x_i, x_i_prime, f, coefficients, w, i):
+    if f.shape[2] == 3:
+        _jacobi_pixels(x_i, x_i_prime, f, coefficients, w, i, 3)
+    elif f.shape[2] == 1:
+        _jacobi_pixels(x_i, x_i_prime, f, coefficients, w, i, 1)
+    else:
+        _jacobi_pixels(x_i, x_i_prime, f, coefficients, w, i, f.shape[2])
+
+
+@njit(fastmath=True, inline='always')
+def _jacobi_pixels(x_i, x_i_prime, f, coefficients, w, i, n_channels):
+    h2 = _like(f, (1 / (f.shape[0] - 1)) ** 2)
+    w = _like(f, w)
+    up, mid, down, mid_prime = x_i[i], x_i[i + 1], x_i[i + 2], x_i_prime[i + 1]
+    mask, mask_inv_n = coefficients[0, i], coefficients[1, i]
+
+    for j in range(f.shape[1]):
+        for c in range(n_channels):
+            mid_prime[j + 1, c] = mid[j + 1, c] + w * (
+                mask_inv_n[j]
+                * (
+                    up[j + 1, c]
+                    + mid[j, c]
+                    + mid[j + 2, c]
+                    + down[j + 1, c]
+                    - h2 * f[i, j, c]
+                )
+                - mask[j] * mid[j + 1, c]
+            )
+
+
+_jacobi_rows = _rows(_jacobi_row, _jacobi_row_branchless, 3)
+
+
+@_kernel
+def _jacobi_iteration_sparse(x_i, x_i_prime, f, unknowns, w, iters):
+    h = _like(f, 1 / (f.shape[0] - 1))
+    w, one_minus_w = _like(f, w), _like(f, 1 - w)
 
     for _ in range(iters):
-        x_i_prime = x_i.copy()
+        for k in prange(unknowns.shape[0]):
+            i, j, n = unknowns[k, 0], unknowns[k, 1], _like(f, unknowns[k, 2])
 
-        for i in range(f.shape[0]):
-            n_vertical = (i > 0) + (i < f.shape[0] - 1)
+            for c in range(f.shape[2]):
+                x_i_prime[i + 1, j + 1, c] = (
+                    x_i[i, j + 1, c]
+                    + x_i[i + 1, j, c]
+                    + x_i[i + 1, j + 2, c]
+                    + x_i[i + 2, j + 1, c]
+                    - h**2 * f[i, j, c]
+                ) / n * w + one_minus_w * x_i[i + 1, j + 1, c]
 
-            for j in range(f.shape[1]):
-                if boundary_m[i, j] < 1:
-                    continue
+        x_i, x_i_prime = x_i_prime, x_i
 
-                n = n_vertical + (j > 0) + (j < f.shape[1] - 1)
 
-                x_i_prime[i + 1, j + 1] = (
-                    x_i[i, j + 1]
-                    + x_i[i + 1, j]
-                    + x_i[i + 1, j + 2]
-                    + x_i[i + 2, j + 1]
-                    - h**2 * f[i, j]
-                ) / n * w + (1 - w) * x_i[i + 1, j + 1]
+class ChebyshevJacobiSolver(Solver):
+    """Poisson's equation solver implemented using Jacobi iteration
+    accelerated by Chebyshev polynomials."""
 
-        x_i = x_i_prime
+    def __init__(self, tol=1e-11, interval=None, n_estimate=20, cache_size=8, **kwargs):
+        """Initialize interval containing the eigenvalues of D^-1 A, where A
+        is the negative Laplacian of the pixels to solve and D its
+        diagonal. Iteration reduces the error components of eigenvalues in
+        the interval optimally, components outside of it still converge
+        if their eigenvalues are in (0, 2).
 
-    return x_i_prime[1:-1, 1:-1]
+        Parameters:
+            interval: (float, float) ... None estimates the interval for
+                each boundary mask, smoother of a multigrid has to be given
+                one covering only the upper part of the spectrum, e.g.
+                (0.3, 2)
+            n_estimate: int ... initial number of Lanczos steps used to
+                estimate the interval, doubled until the estimate settles
+            cache_size: int ... number of estimated intervals kept, least
+                recently used one is dropped first
+        """
+        super().__init__(tol, **kwargs)
+        self.interval = interval
+        self.n_estimate = n_estimate
+        self.cache_size = cache_size
+        self._intervals = OrderedDict()
+        self._lock = Lock()
+
+    def __repr__(self):
+        if self.interval is None:
+            return 'ChebyshevJacobiSolver()'
+
+        a, b = self.interval
+        return f'ChebyshevJacobiSolver(interval=({a:.2f}, {b:.2f}))'
+
+    def prepare(self, x_i, f, boundary_m):
+        """Allocate second approximation buffer, which holds the previous
+        approximation during the iterations."""
+        state = super().prepare(x_i, f, boundary_m)
+        state.x_pad_next = state.x_pad.copy()
+        state.interval = self.interval or self.estimate_interval(boundary_m)
+        state.rho = None
+        return state
+
+    def reset(self, state, x_i, f):
+        super().reset(state, x_i, f)
+        self._interior(state.x_pad_next)[...] = x_i
+        state.rho = None
+
+    def sweep(self, state, f, boundary_m, iters=1):
+        """Implementation of Chebyshev iteration, which is Jacobi iteration
+        with weight w_k and momentum beta_k computed by the recurrence for
+        Chebyshev polynomials on the interval [theta - delta, theta + delta]:
+
+        x_{k+1} = x_k + w_k * D^-1 r_k + beta_k * (x_k - x_{k-1})
+
+        rho_0 = delta / theta, w_0 = 1 / theta, beta_0 = 0
+        rho_k = 1 / (2 * theta / delta - rho_{k-1})
+        w_k = 2 * rho_k / delta, beta_k = rho_k * rho_{k-1}
+
+        Each pixel only reads x_k, so x_{k+1} replaces x_{k-1} in place.
+        """
+        a, b = state.interval
+        theta, delta = (b + a) / 2, (b - a) / 2
+        weights, betas = np.zeros(iters), np.zeros(iters)
+
+        for k in range(iters):
+            if state.rho is None:
+                state.rho = delta / theta
+                weights[k] = 1 / theta
+            else:
+                rho = 1 / (2 * theta / delta - state.rho)
+                weights[k], betas[k] = 2 * rho / delta, rho * state.rho
+                state.rho = rho
+
+        mask = self._mask(state, boundary_m)
+
+        for x_pad, x_pad_next, f in self._planes(state.x_pad, state.x_pad_next, f):
+            if self.sparse:
+                self._kernel(_chebyshev_iteration_sparse)(
+                    x_pad, x_pad_next, f, state.unknowns, weights, betas
+                )
+            else:
+                self._kernel(_chebyshev_iteration)(
+                    x_pad, x_pad_next, f, mask, weights, betas
+                )
+
+        # After an odd number of iterations result is in the second buffer
+        if iters % 2:
+            state.x_pad, state.x_pad_next = state.x_pad_next, state.x_pad
+            state.x = self._interior(state.x_pad)
+
+    def estimate_interval(self, boundary_m):
+        """Estimate interval [1 - rho, 1 + rho] containing the eigenvalues
+        of D^-1 A. Graph of the pixels is bipartite, so they are symmetric
+        around 1 and rho is the largest eigenvalue of the Jacobi iteration
+        matrix D^-1/2 (D - A) D^-1/2, which is estimated by Lanczos steps.
+        Intervals are cached per boundary mask."""
+        key = self._key(boundary_m)
+        with self._lock:
+            interval = self._intervals.get(key)
+
+        if interval is None:
+            rho = 0.0
+            if np.any(boundary_m == 1):
+                laplacian = _stencil_matrix(self._kernel(_stencil)(boundary_m))
+                d = 1 / np.sqrt(-laplacian.diagonal())
+                jacobi = diags(d) @ laplacian @ diags(d) + identity(len(d))
+                rho = _spectral_radius(jacobi, self.n_estimate)
+            interval = (1 - rho, 1 + rho)
+
+        with self._lock:
+            self._intervals[key] = interval
+            self._intervals.move_to_end(key)
+            while len(self._intervals) > self.cache_size:
+                self._intervals.popitem(last=False)
+
+        return interval
+
+
+def _spectral_radius(jacobi, n_steps, rtol=0.1):
+    """Largest eigenvalue rho < 1 of symmetric Jacobi iteration matrix
+    estimated by the largest Ritz value of Lanczos steps starting from a
+    random vector. Ritz value approaches rho from below and Chebyshev
+    iteration slows down a lot when 1 - rho is overestimated, so the number
+    of steps starts at [n_steps] and doubles until 1 - rho changes by less
+    than [rtol]."""
+    v = np.random.default_rng(0).standard_normal(jacobi.shape[0])
+    v /= np.linalg.norm(v)
+    v_prev, beta = np.zeros_like(v), 0.0
+    alphas, betas = [], []
+    rho, check = None, n_steps
+
+    for k in range(1, jacobi.shape[0] + 1):
+        w = jacobi @ v - beta * v_prev
+        alphas.append(v @ w)
+        w -= alphas[-1] * v
+        beta = np.linalg.norm(w)
+
+        if k == check or beta < 1e-12 or k == jacobi.shape[0]:
+            ritz = eigvalsh_tridiagonal(np.array(alphas), np.array(betas))[-1]
+            converged = rho is not None and 1 - ritz > (1 - rtol) * (1 - rho)
+            rho, check = ritz, 2 * check
+
+            if converged or beta < 1e-12:
+                break
+
+        betas.append(beta)
+        v_prev, v = v, w / beta
+
+    return rho
+
+
+@_kernel
+def _chebyshev_iteration(x_i, x_i_prime, f, mask, weights, betas):
+    for k in range(weights.shape[0]):
+        for i in prange(f.shape[0]):
+            _chebyshev_rows(x_i, x_i_prime, f, mask, weights[k], betas[k], i)
+
+        x_i, x_i_prime = x_i_prime, x_i
+
+
+@njit
+def _chebyshev_row(x_i, x_i_prime, f, boundary_m, w, beta, i):
+    h = _like(f, 1 / (f.shape[0] - 1))
+    w, beta = _like(f, w), _like(f, beta)
+    n_vertical = (i > 0) + (i < f.shape[0] - 1)
+
+    for j in range(f.shape[1]):
+        if boundary_m[i, j] < 1:
+            continue
+
+        n = _like(f, n_vertical + (j > 0) + (j < f.shape[1] - 1))
+
+        for c in range(f.shape[2]):
+            x_ij = x_i[i + 1, j + 1, c]
+            x_i_prime[i + 1, j + 1, c] = (
+                x_ij
+                + w
+                * (
+                    (
+                        x_i[i, j + 1, c]
+                        + x_i[i + 1, j, c]
+                        + x_i[i + 1, j + 2, c]
+                        + x_i[i + 2, j + 1, c]
+                        - h**2 * f[i, j, c]
+                    )
+                    / n
+                    - x_ij
+                )
+                + beta * (x_ij - x_i_prime[i + 1, j + 1, c])
+            )
+
+
+@njit(fastmath=True)
+def _chebyshev_row_branchless(x_i, x_i_prime, f, coefficients, w, beta, i):
+    if f.shape[2] == 3:
+        _chebyshev_pixels(x_i, x_i_prime, f, coefficients, w, beta, i, 3)
+    elif f.shape[2] == 1:
+        _chebyshev_pixels(x_i, x_i_prime, f, coefficients, w, beta, i, 1)
+    else:
+        _chebyshev_pixels(x_i, x_i_prime, f, coefficients, w, beta, i, f.shape[2])
+
+
+@njit(fastmath=True, inline='always')
+def _chebyshev_pixels(x_i, x_i_prime, f, coefficients, w, beta, i, n_channels):
+    h2 = _like(f, (1 / (f.shape[0] - 1)) ** 2)
+    w, beta = _like(f, w), _like(f, beta)
+    up, mid, down, mid_prime = x_i[i], x_i[i + 1], x_i[i + 2], x_i_prime[i + 1]
+    mask, mask_inv_n = coefficients[0, i], coefficients[1, i]
+
+    for j in range(f.shape[1]):
+        for c in range(n_channels):
+            mid_prime[j + 1, c] = mid[j + 1, c] + mask[j] * (
+                w
+                * (
+                    mask_inv_n[j]
+                    * (
+                        up[j + 1, c]
+                        + mid[j, c]
+                        + mid[j + 2, c]
+                        + down[j + 1, c]
+                        - h2 * f[i, j, c]
+                    )
+                    - mid[j + 1, c]
+                )
+                + beta * (mid[j + 1, c] - mid_prime[j + 1, c])
+            )
+
+
+_chebyshev_rows = _rows(_chebyshev_row, _chebyshev_row_branchless, 3)
+
+
+@_kernel
+def _chebyshev_iteration_sparse(x_i, x_i_prime, f, unknowns, weights, betas):
+    h = _like(f, 1 / (f.shape[0] - 1))
+
+    for k in range(weights.shape[0]):
+        w, beta = _like(f, weights[k]), _like(f, betas[k])
+
+        for u in prange(unknowns.shape[0]):
+            i, j, n = unknowns[u, 0], unknowns[u, 1], _like(f, unknowns[u, 2])
+
+            for c in range(f.shape[2]):
+                x_ij = x_i[i + 1, j + 1, c]
+                x_i_prime[i + 1, j + 1, c] = (
+                    x_ij
+                    + w
+                    * (
+                        (
+                            x_i[i, j + 1, c]
+                            + x_i[i + 1, j, c]
+                            + x_i[i + 1, j + 2, c]
+                            + x_i[i + 2, j + 1, c]
+                            - h**2 * f[i, j, c]
+                        )
+                        / n
+                        - x_ij
+                    )
+                    + beta * (x_ij - x_i_prime[i + 1, j + 1, c])
+                )
+
+        x_i, x_i_prime = x_i_prime, x_i
 
 
 class SuccessiveOverRelaxationSolver(Solver):
     """Poisson's equation solver implemented using Successive Over Relaxation
     iteration."""
 
-    def __init__(self, tol=1e-11, omega=1):
+    def __init__(
+        self,
+        tol=1e-11,
+        omega=1,
+        split=False,
+        tile_sweeps=None,
+        tile_steps=False,
+        **kwargs,
+    ):
         """Initialize SOR solver parameters. If omega == 1, iteration
         becomes Gauss-Seidel. SOR implementation is using red-black GS.
 
         Parameters:
-            omega: float in (0, 2)
+            omega: float in (0, 2) or 'adaptive' ... start with Gauss-Seidel
+                and move omega toward the optimal value estimated from
+                ratios of successive residual norms during the solve,
+                multigrid and Anderson mixing only run sweeps, which do not
+                adapt it, so they reject it
+            split: bool ... store red and black pixels in separate arrays
+                during the solve, so each phase reads contiguous memory
+            tile_sweeps: int ... number of sweeps done on each band of rows
+                before moving to the next one when running multiple
+                iterations, None disables tiling
+            tile_steps: bool ... each step of solve runs [tile_sweeps]
+                tiled iterations before the one computing the residual, so
+                the residual is checked every tile_sweeps + 1 iterations
         """
-        super().__init__(tol)
-        self.omega = omega
+        super().__init__(tol, **kwargs)
+        if split and (self.branchless or self.sparse or self.planar):
+            raise ValueError('Split layout has its own kernels')
+        if tile_sweeps is not None and (self.sparse or split):
+            raise ValueError('Only iteration over rows can be tiled')
+        if tile_steps and tile_sweeps is None:
+            raise ValueError('Tiled steps need tile_sweeps')
+
+        if omega == 'adaptive':
+            self.adaptive, self.omega = True, 1.0
+        else:
+            # Float keeps a single signature of the kernels, so ones compiled
+            # ahead of time are reused for any omega
+            self.adaptive, self.omega = False, float(omega)
 
-        self.iteration(np.zeros((2, 2, 3)), np.zeros((2, 2, 3)), np.zeros((2, 2)))
+        self.split = split
+        self.tile_sweeps = tile_sweeps
+        self.tile_steps = tile_steps
 
     def __repr__(self):
+        if self.adaptive:
+            return 'SuccessiveOverRelaxationSolver(omega=adaptive)'
         return f'SuccessiveOverRelaxationSolver(omega={self.omega:.2f})'
 
-    def iteration(self, x_i, f, boundary_m, iters=1):
+    def prepare(self, x_i, f, boundary_m):
+        """Split list of pixels to solve into red and black ones. With the
+        split layout, padded approximation, right-hand side and numbers of
+        neighbours (0 on boundary points) are split by color into arrays of
+        shape (2, n + 2, (n + 3) // 2, ...), where row i of color c holds
+        pixels j = 2 * k + (i + c) % 2 of the padded image."""
+        state = super().prepare(x_i, f, boundary_m)
+
+        if self.sparse:
+            red = (state.unknowns[:, 0] + state.unknowns[:, 1]) % 2 == 0
+            state.unknowns_colors = (state.unknowns[red], state.unknowns[~red])
+
+        if self.split:
+            n = self._kernel(_coefficients)(boundary_m)[2]
+            n_pad = np.pad(n, 1)[:, :, np.newaxis]
+            state.f_pad = np.pad(f, ((1, 1), (1, 1), (0, 0)))
+            state.x_split = _split_zeros(state.x_pad)
+            state.f_split = _split_zeros(state.f_pad)
+            n_split = _split_zeros(n_pad)
+            self._kernel(_split)(n_pad, n_split)
+            state.n_split = n_split[..., 0]
+
+        self.reset(state, x_i, f)
+        return state
+
+    def reset(self, state, x_i, f):
+        """Reset omega and its adaptation, and split approximation and
+        right-hand side again with the split layout."""
+        super().reset(state, x_i, f)
+        state.omega = self.omega
+        state.residual_norm = None
+        state.ratios = []
+
+        if self.split:
+            self._interior(state.f_pad)[...] = f
+            self._kernel(_split)(state.x_pad, state.x_split)
+            self._kernel(_split)(state.f_pad, state.f_split)
+
+    def finish(self, state):
+        """Merge red and black pixels back into x."""
+        if self.split:
+            self._kernel(_merge)(state.x_split, state.x_pad)
+
+    def update_residual(self, state, f, boundary_m, r=None):
+        """Compute residual into r, reading the split layout if used."""
+        if not self.split:
+            return super().update_residual(state, f, boundary_m, r)
+
+        if r is None:
+            r = state.r
+
+        self._kernel(_residual_split)(
+            state.x_split, state.f_split, state.n_split, r, True
+        )
+        return r
+
+    def sweep(self, state, f, boundary_m, iters=1):
         """Implementation of SOR iteration using red-black Gauss-Seidel.
 
         Update formula:
@@ -205,124 +1238,779 @@ class SuccessiveOverRelaxationSolver(Solver):
             - h^2 * f_ij
         ) / 4 + (1 - omega) * x_ij_k
         """
-        return _sor_iteration(
-            np.pad(x_i, ((1, 1), (1, 1), (0, 0))),
-            f,
-            boundary_m,
-            self.omega,
-            iters,
-        )
+        if self.split:
+            self._kernel(_sor_iteration_split)(
+                state.x_split, state.f_split, state.n_split, state.omega, iters
+            )
+            return
+
+        mask = self._mask(state, boundary_m)
+        tiled = self.tile_sweeps is not None and iters > 1
+        n_chunks = self._n_chunks(self._shape(f)[0], 4 * (self.tile_sweeps or 1))
+
+        for x_pad, f in self._planes(state.x_pad, f):
+            if self.sparse:
+                self._kernel(_sor_iteration_sparse)(
+                    x_pad, f, state.unknowns_colors, state.omega, iters
+                )
+            elif tiled:
+                self._kernel(_sor_iteration_tiled)(
+                    x_pad,
+                    f,
+                    mask,
+                    state.omega,
+                    iters,
+                    self.tile_sweeps,
+                    n_chunks,
+                )
+            else:
+                self._kernel(_sor_iteration)(x_pad, f, mask, state.omega, iters)
+
+    def step(self, state, f, boundary_m, store_residual=False):
+        """SOR iteration fused with computation of the new residual,
+        preceded by tiled iterations if tile_steps is set. Sparse iteration
+        computes the residual in a separate pass. With adaptive omega, the
+        residual norm is used to update omega for the next step."""
+        iters = 1
+        if self.tile_steps:
+            self.sweep(state, f, boundary_m, self.tile_sweeps)
+            iters += self.tile_sweeps
+
+        residual_norm = self._step(state, f, boundary_m, store_residual)
+        if self.adaptive:
+            self.adapt_omega(state, residual_norm, iters)
+        return residual_norm
+
+    def adapt_omega(self, state, residual_norm, iters=1, n_stable=5, rtol=0.05):
+        """Estimate spectral radius of Jacobi iteration mu from the ratio
+        lambda of successive residual norms and set omega to the optimal
+        value for it. Asymptotically, lambda is the spectral radius of SOR
+        iteration with the current omega, which for omega <= omega_opt
+        satisfies (lambda + omega - 1)^2 = lambda * omega^2 * mu^2, so
+
+        mu = (lambda + omega - 1) / (omega * sqrt(lambda))
+        omega_opt = 2 / (1 + sqrt(1 - mu^2))
+
+        Estimate is only used once the ratio changed by less than [rtol]
+        of its distance from 1 over the last [n_stable] iterations, the
+        ratio of the first iterations after changing omega is dominated by
+        other eigenvectors. Ratio underestimates the spectral radius until
+        then, so omega approaches omega_opt from below and is only
+        increased. Close to omega_opt, lambda approaches omega - 1 and the
+        estimate becomes unreliable, omega is kept once lambda is below
+        (omega - 1)^0.75, as overshooting slows convergence down again.
+        Residual norms [iters] iterations apart give the ratio per iteration
+        as the root of their ratio."""
+        previous, state.residual_norm = state.residual_norm, residual_norm
+        if not previous:
+            return
+
+        state.ratios.append((residual_norm / previous) ** (1 / iters))
+        ratios = state.ratios = state.ratios[-n_stable:]
+        ratio = ratios[-1]
+        if (
+            len(ratios) < n_stable
+            or ratio >= 1
+            or max(ratios) - min(ratios) > rtol * (1 - ratio)
+            or ratio <= (state.omega - 1) ** 0.75
+        ):
+            return
+
+        omega = state.omega
+        mu = min((ratio + omega - 1) / (omega * np.sqrt(ratio)), 1.0)
+        omega_opt = 2 / (1 + np.sqrt(1 - mu**2))
+        if omega_opt > omega:
+            state.omega = min(omega_opt, 1.999)
+            state.ratios = []
+
+    def _step(self, state, f, boundary_m, store_residual):
+        if self.sparse:
+            return super().step(state, f, boundary_m, store_residual)
+
+        if self.split:
+            self.sweep(state, f, boundary_m)
+            r_r = self._kernel(_residual_split)(
+                state.x_split, state.f_split, state.n_split, state.r, store_residual
+            )
+            return self._residual_norm(r_r, f.shape[0])
+
+        mask = self._mask(state, boundary_m)
+        n = self._shape(f)[0]
+        r_r = 0.0
+
+        for x_pad, f, r in self._planes(state.x_pad, f, state.r):
+            r_r += self._kernel(_sor_residual_iteration)(
+                x_pad,
+                f,
+                mask,
+                state.omega,
+                r,
+                store_residual,
+                self._n_chunks(n),
+            )
+
+        return self._residual_norm(r_r, n)
+
+
+@_kernel
+def _sor_iteration(x_i, f, mask, omega, iters):
+    for _ in range(iters):
+        # Pixels of one color only depend on the pixels of the other one,
+        # so they can be updated in place and rows can be updated in
+        # parallel within each phase
+        for color in (0, 1):
+            for i in prange(f.shape[0]):
+                _sor_rows(x_i, f, mask, omega, i, color)
+
+
+@_kernel
+def _sor_iteration_tiled(x_i, f, mask, omega, iters, tile_sweeps, n_chunks):
+    """SOR iteration running [tile_sweeps] sweeps at once. Same as the tiled
+    Jacobi iteration, with red and black phases of each sweep as steps of
+    the wavefront. Phase t updates row i - t right after phase t - 1
+    updates row i - t + 1, before any of its neighbours are updated by
+    phase t + 1."""
+    n_rows = f.shape[0]
+
+    for done in range(0, iters, tile_sweeps):
+        n_phases = 2 * min(tile_sweeps, iters - done)
+
+        for k in prange(n_chunks):
+            start, end = _chunk(n_rows, n_chunks, k)
+
+            for s in range(start, end + n_phases - 1):
+                for t in range(n_phases):
+                    i = s - t
+
+                    if start + t * (k > 0) <= i < end - t * (end < n_rows):
+                        _sor_rows(x_i, f, mask, omega, i, t % 2)
+
+        for k in prange(1, n_chunks):
+            start, _ = _chunk(n_rows, n_chunks, k)
+
+            for t in range(1, n_phases):
+                for i in range(start - t, start + t):
+                    _sor_rows(x_i, f, mask, omega, i, t % 2)
+
+
+@_kernel
+def _sor_residual_iteration(x_i, f, mask, omega, r, store_residual, n_chunks):
+    """SOR iteration which also computes residual of the new approximation
+    and returns its squared norm. Red row i, black row i - 1 and residual
+    of row i - 2 are computed together, which gives the same result as
+    updating all red pixels before the black ones. Rows are split into
+    chunks, black rows on the border between chunks need red rows from both
+    of them, so they and residual of rows around them are computed after
+    all chunks are updated."""
+    n_rows = f.shape[0]
+    r_r = np.zeros(n_chunks)
+
+    for k in prange(n_chunks):
+        start, end = _chunk(n_rows, n_chunks, k)
+        black_start, black_end = start + (k > 0), end - (end < n_rows)
+        residual_start = black_start + (k > 0)
+        residual_end = black_end - (end < n_rows)
+
+        for i in range(start, end + 2):
+            if i < end:
+                _sor_rows(x_i, f, mask, omega, i, 0)
+
+            if black_start <= i - 1 < black_end:
+                _sor_rows(x_i, f, mask, omega, i - 1, 1)
+
+            if residual_start <= i - 2 < residual_end:
+                r_r[k] += _residual_rows(x_i, f, mask, r, i - 2, store_residual)
+
+    for k in prange(1, n_chunks):
+        start, _ = _chunk(n_rows, n_chunks, k)
+        _sor_rows(x_i, f, mask, omega, start - 1, 1)
+        _sor_rows(x_i, f, mask, omega, start, 1)
+
+    r_r_borders = np.zeros(n_chunks)
+
+    for k in prange(1, n_chunks):
+        start, _ = _chunk(n_rows, n_chunks, k)
+
+        for i in range(start - 2, start + 2):
+            r_r_borders[k] += _residual_rows(x_i, f, mask, r, i, store_residual)
+
+    return np.sum(r_r) + np.sum(r_r_borders)
 
 
 @njit
-def _sor_iteration(x_i, f, boundary_m, omega, iters):
-    h = 1 / (f.shape[0] - 1)
+def _sor_row(x_i, f, boundary_m, omega, i, color):
+    h = _like(f, 1 / (f.shape[0] - 1))
+    omega, one_minus_omega = _like(f, omega), _like(f, 1 - omega)
+    n_vertical = (i > 0) + (i < f.shape[0] - 1)
+
+    for j in range((i + color) % 2, f.shape[1], 2):
+        if boundary_m[i, j] < 1:
+            continue
+
+        n = _like(f, n_vertical + (j > 0) + (j < f.shape[1] - 1))
+
+        for c in range(f.shape[2]):
+            x_i[i + 1, j + 1, c] = (
+                x_i[i, j + 1, c]
+                + x_i[i + 1, j, c]
+                + x_i[i + 1, j + 2, c]
+                + x_i[i + 2, j + 1, c]
+                - h**2 * f[i, j, c]
+            ) / n * omega + one_minus_omega * x_i[i + 1, j + 1, c]
+
+
+@njit(fastmath=True)
+def _sor_row_branchless(x_i, f, coefficients, omega, i, color):
+    if f.shape[2] == 3:
+        _sor_pixels(x_i, f, coefficients, omega, i, color, 3)
+    elif f.shape[2] == 1:
+        _sor_pixels(x_i, f, coefficients, omega, i, color, 1)
+    else:
+        _sor_pixels(x_i, f, coefficients, omega, i, color, f.shape[2])
+
+
+@njit(fastmath=True, inline='always')
+def _sor_pixels(x_i, f, coefficients, omega, i, color, n_channels):
+    h2 = _like(f, (1 / (f.shape[0] - 1)) ** 2)
+    omega = _like(f, omega)
+    up, mid, down = x_i[i], x_i[i + 1], x_i[i + 2]
+    mask, mask_inv_n = coefficients[0, i], coefficients[1, i]
+
+    for j in range((i + color) % 2, f.shape[1], 2):
+        for c in range(n_channels):
+            mid[j + 1, c] += omega * (
+                mask_inv_n[j]
+                * (
+                    up[j + 1, c]
+                    + mid[j, c]
+                    + mid[j + 2, c]
+                    + down[j + 1, c]
+                    - h2 * f[i, j, c]
+                )
+                - mask[j] * mid[j + 1, c]
+            )
+
+
+_sor_rows = _rows(_sor_row, _sor_row_branchless, 2)
+
+
+@_kernel
+def _sor_iteration_sparse(x_i, f, unknowns_colors, omega, iters):
+    h = _like(f, 1 / (f.shape[0] - 1))
+    omega, one_minus_omega = _like(f, omega), _like(f, 1 - omega)
 
     for _ in range(iters):
-        x_i_prime = x_i.copy()
+        for unknowns in unknowns_colors:
+            for k in prange(unknowns.shape[0]):
+                i, j, n = unknowns[k, 0], unknowns[k, 1], _like(f, unknowns[k, 2])
+
+                for c in range(f.shape[2]):
+                    x_i[i + 1, j + 1, c] = (
+                        x_i[i, j + 1, c]
+                        + x_i[i + 1, j, c]
+                        + x_i[i + 1, j + 2, c]
+                        + x_i[i + 2, j + 1, c]
+                        - h**2 * f[i, j, c]
+                    ) / n * omega + one_minus_omega * x_i[i + 1, j + 1, c]
+
+
+def _split_zeros(a):
+    """Zero array holding red and black pixels of padded array [a]."""
+    return np.zeros((2, a.shape[0], (a.shape[1] + 1) // 2, a.shape[2]), dtype=a.dtype)
+
+
+@_kernel
+def _split(a, a_split):
+    """Split padded array [a] into red and black pixels of [a_split]."""
+    for color in range(2):
+        for i in prange(a.shape[0]):
+            offset = (i + color) % 2
+
+            for k in range((a.shape[1] - offset + 1) // 2):
+                for c in range(a.shape[2]):
+                    a_split[color, i, k, c] = a[i, 2 * k + offset, c]
+
+
+@_kernel
+def _merge(a_split, a):
+    """Write red and black pixels from [a_split] back into padded [a]."""
+    for color in range(2):
+        for i in prange(a.shape[0]):
+            offset = (i + color) % 2
+
+            for k in range((a.shape[1] - offset + 1) // 2):
+                for c in range(a.shape[2]):
+                    a[i, 2 * k + offset, c] = a_split[color, i, k, c]
+
+
+@_kernel
+def _sor_iteration_split(x_split, f_split, n_split, omega, iters):
+    """SOR iteration on the split layout. Left and right neighbours of pixel
+    k in row i of one color are pixels k + offset - 1 and k + offset of the
+    other one, neighbours above and below have the same index k."""
+    h = _like(f_split, 1 / (x_split.shape[1] - 3))
+    omega = _like(f_split, omega)
+    one_minus_omega = _like(f_split, 1 - omega)
 
+    for _ in range(iters):
         for color in (0, 1):
-            for i in range(f.shape[0]):
-                n_vertical = (i > 0) + (i < f.shape[0] - 1)
+            x_i, x_other = x_split[color], x_split[1 - color]
+            f, n_neighbours = f_split[color], n_split[color]
+
+            for i in prange(1, x_i.shape[0] - 1):
+                offset = (i + color) % 2
 
-                for j in range((i + color) % 2, f.shape[1], 2):
-                    if boundary_m[i, j] < 1:
+                for k in range(x_i.shape[1]):
+                    n = n_neighbours[i, k]
+                    if n == 0:
                         continue
 
-                    n = n_vertical + (j > 0) + (j < f.shape[1] - 1)
+                    for c in range(x_i.shape[2]):
+                        x_i[i, k, c] = (
+                            x_other[i - 1, k, c]
+                            + x_other[i, k + offset - 1, c]
+                            + x_other[i, k + offset, c]
+                            + x_other[i + 1, k, c]
+                            - h**2 * f[i, k, c]
+                        ) / n * omega + one_minus_omega * x_i[i, k, c]
+
+
+@_kernel
+def _residual_split(x_split, f_split, n_split, r, store_residual):
+    """Compute residual on the split layout and return its squared norm.
+    Residual is stored into r in the usual layout."""
+    h = _like(f_split, 1 / (x_split.shape[1] - 3))
+    r_r = 0.0
+
+    for color in range(2):
+        x_i, x_other = x_split[color], x_split[1 - color]
+        f, n_neighbours = f_split[color], n_split[color]
+
+        for i in prange(1, x_i.shape[0] - 1):
+            offset = (i + color) % 2
+
+            for k in range(x_i.shape[1]):
+                n = n_neighbours[i, k]
+                if n == 0:
+                    continue
 
-                    x_i_prime[i + 1, j + 1] = (
-                        x_i_prime[i, j + 1]
-                        + x_i_prime[i + 1, j]
-                        + x_i_prime[i + 1, j + 2]
-                        + x_i_prime[i + 2, j + 1]
-                        - h**2 * f[i, j]
-                    ) / n * omega + (1 - omega) * x_i[i + 1, j + 1]
+                for c in range(x_i.shape[2]):
+                    r_ij = (
+                        f[i, k, c]
+                        - (
+                            x_other[i - 1, k, c]
+                            + x_other[i, k + offset - 1, c]
+                            + x_other[i, k + offset, c]
+                            + x_other[i + 1, k, c]
+                            - n * x_i[i, k, c]
+                        )
+                        / h**2
+                    )
+                    r_r += r_ij**2
 
-        x_i = x_i_prime
+                    if store_residual:
+                        r[i - 1, 2 * k + offset - 1, c] = r_ij
 
-    return x_i_prime[1:-1, 1:-1]
+    return r_r
 
 
 class ConjugateGradientSolver(Solver):
     """Poisson's equation solver implemented using conjugate gradient method."""
 
-    def __init__(self, tol=1e-11, save_state=True):
+    def __init__(self, tol=1e-11, save_state=True, preconditioner=None, **kwargs):
         """Initialize attribute holding conjugate gradient and next residual.
 
         Parameters:
             save_state: bool ... preserve state after each iteration
+            preconditioner: str ... None or 'dct', which solves Poisson's
+                equation on the whole image without the boundary points
+                using the discrete cosine transform
         """
-        super().__init__(tol)
-        self.reset_solver()
-        self.save_state = save_state
+        super().__init__(tol, **kwargs)
+        if preconditioner not in (None, 'dct'):
+            raise ValueError(f'Unknown preconditioner {preconditioner}')
 
-        _laplacian(np.zeros((4, 4, 3)), np.zeros((2, 2)))
-        self.reset_solver()
+        self.save_state = save_state
+        self.preconditioner = preconditioner
 
     def __repr__(self):
-        return 'ConjugateGradientSolver()'
-
-    def reset_solver(self):
-        self.conjugate_gradient = None
-        self.next_residual = None
+        if self.preconditioner is None:
+            return 'ConjugateGradientSolver()'
+
+        return f'ConjugateGradientSolver(preconditioner={self.preconditioner})'
+
+    def prepare(self, x_i, f, boundary_m):
+        """Allocate buffers for the conjugate gradient (padded), residual
+        and its Laplacian. Conjugate gradient is kept between sweeps on the
+        same state if save_state is set. DCT preconditioner also needs the
+        preconditioned residual and its inverse eigenvalues."""
+        state = super().prepare(x_i, f, boundary_m)
+        state.A_p = np.zeros_like(f)
+        state.conjugate_gradient = np.zeros_like(state.x_pad)
+        state.next_residual = np.zeros_like(f)
+        state.restart = True
+
+        if self.preconditioner == 'dct':
+            state.z = np.zeros_like(f)
+            state.unknown = self._unknown(boundary_m)
+            state.eigenvalues_inv = self._dct_eigenvalues_inv(boundary_m)
+
+        return state
+
+    def reset(self, state, x_i, f):
+        super().reset(state, x_i, f)
+        state.restart = True
+
+    def sweep(self, state, f, boundary_m, iters=1):
+        """Implementation of conjugate gradient iteration. Equations of the
+        channels are independent, so each channel has its own coefficients
+        alpha and beta. Update of the conjugate gradient is fused with its
+        Laplacian and updates of x and r with the new residual norm, so one
+        iteration takes two passes over the images.
+
+        Preconditioned iteration uses z = M^-1 r in place of the residual.
+        Preconditioners which are not exactly symmetric break the usual
+        (Fletcher-Reeves) update of the conjugate gradient, so it uses the
+        Polak-Ribiere one:
+
+        beta = z_{k+1} . (r_{k+1} - r_k) / z_k . r_k
+             = -alpha * z_{k+1} . A p_k / z_k . r_k
+
+        It is the same for a symmetric preconditioner, where
+        z_{k+1} . r_k = 0.
+        """
+        r = state.next_residual
 
-    def iteration(self, x_i, f, boundary_m, iters=1):
-        """Implementation of conjugate gradient iteration."""
-        if self.conjugate_gradient is None:
-            r = self.residual(x_i, f, boundary_m)
-            p = r
-        else:
-            r = self.next_residual
-            p = self.conjugate_gradient
+        # Conjugate gradient is updated with beta at the start of the next
+        # iteration, so beta and z . r are kept in the state between sweeps
+        if state.restart or not self.save_state:
+            self.update_residual(state, f, boundary_m, r)
+            state.r_z = self._dot_channels(r, self.precondition(state, r))
+            state.beta = np.zeros_like(state.r_z)
+            state.r_r = state.r_z
+            if self.preconditioner is not None:
+                state.r_r = self._dot_channels(r, r)
+            state.restart = False
 
-        x_i_prime = x_i.copy()
+        z = r if self.preconditioner is None else state.z
 
         for _ in range(iters):
-            A_p = _laplacian(np.pad(p, ((1, 1), (1, 1), (0, 0))), boundary_m)
-            alpha = np.sum(r * r) / np.sum(p * A_p)
+            # Current approximation is already the exact solution
+            if not np.any(state.r_z):
+                break
+
+            p_A_p = self._direction(state, state.beta, z, boundary_m)
+            alpha = np.divide(
+                state.r_z, p_A_p, out=np.zeros_like(p_A_p), where=p_A_p != 0
+            )
+            r_r = state.r_r = self._update(state, alpha)
+
+            if self.preconditioner is None:
+                r_z, r_z_change = r_r, r_r
+            else:
+                z = self.precondition(state, r)
+                r_z = self._dot_channels(r, z)
+                r_z_change = -alpha * self._dot_channels(z, state.A_p)
+
+            state.beta = np.divide(
+                r_z_change, state.r_z, out=np.zeros_like(r_z), where=state.r_z != 0
+            )
+            state.r_z = r_z
+
+    def step(self, state, f, boundary_m, store_residual=False):
+        """Run one iteration and return the residual norm from r . r which
+        the update of r computes, so the iteration takes no extra passes.
+        Residual is copied into r only if store_residual is set, solve
+        recomputes the final one."""
+        self.sweep(state, f, boundary_m)
+        if store_residual:
+            state.r[...] = state.next_residual
+
+        return self._residual_norm(np.sum(state.r_r), self._shape(f)[0])
+
+    def precondition(self, state, r):
+        """Preconditioned residual z = M^-1 r, which is r itself without a
+        preconditioner. DCT preconditioner transforms r, divides it by the
+        eigenvalues of the Laplacian and transforms it back, which solves
+        the equation in O(n^2 log n). Pixels of z on boundary points are
+        set to 0."""
+        if self.preconditioner is None:
+            return r
+
+        axes = (1, 2) if self.planar else (0, 1)
+        workers = self.n_threads if self.parallel else None
+        r_dct = dctn(r, norm='ortho', axes=axes, workers=workers)
+        r_dct *= state.eigenvalues_inv
+        z = idctn(r_dct, norm='ortho', axes=axes, workers=workers, overwrite_x=True)
+        np.multiply(z, state.unknown, out=state.z)
+        return state.z
+
+    def laplacian(self, state, x_pad, boundary_m, l):
+        """Compute Laplacian of padded x_pad on pixels to solve into l."""
+        mask = self._mask(state, boundary_m)
+
+        for x_pad, l_plane in self._planes(x_pad, l):
+            if self.sparse:
+                self._kernel(_laplacian_sparse)(x_pad, state.unknowns, l_plane)
+            else:
+                self._kernel(_laplacian)(x_pad, mask, l_plane)
+
+        return l
+
+    def _dct_eigenvalues_inv(self, boundary_m):
+        """Inverse eigenvalues of the Laplacian with boundary points
+        treated as pixels to solve, whose eigenvectors are the DCT basis.
+        They are shifted by 1 / 2 of the inverse mean squared distance from
+        the pixels to solve to the nearest boundary point, which accounts
+        for boundary points spread over the image. Inverse of the 0
+        eigenvalue is set to 0."""
+        n, m = boundary_m.shape
+        h = 1 / (n - 1)
+        eigenvalues = (
+            -4
+            * (
+                np.sin(np.pi * np.arange(n) / (2 * n))[:, np.newaxis] ** 2
+                + np.sin(np.pi * np.arange(m) / (2 * m)) ** 2
+            )
+            / h**2
+        )
+
+        unknown = boundary_m == 1
+        if np.any(unknown) and not np.all(unknown):
+            distance = distance_transform_edt(unknown)[unknown]
+            eigenvalues -= 0.5 / (h**2 * np.mean(distance**2))
+
+        eigenvalues_inv = np.divide(
+            1, eigenvalues, out=np.zeros_like(eigenvalues), where=eigenvalues != 0
+        ).astype(boundary_m.dtype, copy=False)
+        return eigenvalues_inv if self.planar else eigenvalues_inv[:, :, np.newaxis]
+
+    def _direction(self, state, beta, z, boundary_m):
+        """Update conjugate gradient p = z + beta * p and compute its
+        Laplacian into A_p, returns p . A_p of each channel."""
+        mask = self._mask(state, boundary_m)
+        n_chunks = self._n_chunks(self._shape(z)[0])
+        beta = beta.astype(z.dtype, copy=False)
+        p_A_p = []
+
+        for beta, z, p_pad, A_p in self._channel_planes(
+            beta, z, state.conjugate_gradient, state.A_p
+        ):
+            if self.sparse:
+                self._kernel(_direction_sparse)(beta, z, p_pad, state.unknowns)
+                self._kernel(_laplacian_sparse)(p_pad, state.unknowns, A_p)
+                p_A_p.append(self._kernel(_dot_channels)(p_pad[1:-1, 1:-1], A_p))
+            else:
+                p_A_p.append(
+                    self._kernel(_direction)(beta, z, p_pad, mask, A_p, n_chunks)
+                )
+
+        return np.concatenate(p_A_p)
+
+    def _update(self, state, alpha):
+        """Update x = x + alpha * p and r = r - alpha * A_p, returns r . r
+        of each channel."""
+        alpha = alpha.astype(state.A_p.dtype, copy=False)
+        r_r = []
+
+        for alpha, p_pad, A_p, x_pad, r in self._channel_planes(
+            alpha, state.conjugate_gradient, state.A_p, state.x_pad, state.next_residual
+        ):
+            r_r.append(self._kernel(_update)(alpha, p_pad, A_p, x_pad, r))
+
+        return np.concatenate(r_r)
+
+    def _dot_channels(self, a, b):
+        """Inner product of each channel of two images."""
+        return np.concatenate(
+            [self._kernel(_dot_channels)(a, b) for a, b in self._planes(a, b)]
+        )
+
+    def _channel_planes(self, coefficients, *images):
+        """Planes of [images] passed to the kernels along with the per
+        channel [coefficients] of the channels they hold."""
+        if not self.planar:
+            return [(coefficients, *images)]
 
-            x_i_prime += alpha * p
-            r_next = r - alpha * A_p
+        return [
+            (coefficients[c : c + 1], *planes)
+            for c, planes in enumerate(self._planes(*images))
+        ]
 
-            beta = np.sum(r_next * r_next) / np.sum(r * r)
-            p = r_next + beta * p
-            r = r_next
 
-        if self.save_state:
-            self.next_residual = r_next
-            self.conjugate_gradient = p
+@_kernel
+def _laplacian(x_i, mask, l):
+    for i in prange(l.shape[0]):
+        _laplacian_rows(x_i, mask, l, i)
 
-        return x_i_prime
+    return l
 
 
 @njit
-def _laplacian(x_i, boundary_m):
-    h = 1 / (boundary_m.shape[0] - 1)
-    l = np.zeros((*boundary_m.shape, x_i.shape[2]))
+def _laplacian_row(x_i, boundary_m, l, i):
+    h = _like(l, 1 / (l.shape[0] - 1))
+    n_vertical = (i > 0) + (i < l.shape[0] - 1)
+
+    for j in range(l.shape[1]):
+        if boundary_m[i, j] < 1:
+            continue
+
+        n = _like(l, n_vertical + (j > 0) + (j < l.shape[1] - 1))
+
+        for c in range(l.shape[2]):
+            l[i, j, c] = (
+                x_i[i, j + 1, c]
+                + x_i[i + 1, j, c]
+                + x_i[i + 1, j + 2, c]
+                + x_i[i + 2, j + 1, c]
+                - n * x_i[i + 1, j + 1, c]
+            ) / h**2
 
-    for i in range(boundary_m.shape[0]):
-        n_vertical = (i > 0) + (i < boundary_m.shape[0] - 1)
-        for j in range(boundary_m.shape[1]):
-            if boundary_m[i, j] < 1:
-                continue
 
-            n = n_vertical + (j > 0) + (j < boundary_m.shape[1] - 1)
+@njit(fastmath=True)
+def _laplacian_row_branchless(x_i, coefficients, l, i):
+    if l.shape[2] == 3:
+        _laplacian_pixels(x_i, coefficients, l, i, 3)
+    elif l.shape[2] == 1:
+        _laplacian_pixels(x_i, coefficients, l, i, 1)
+    else:
+        _laplacian_pixels(x_i, coefficients, l, i, l.shape[2])
+
+
+@njit(fastmath=True, inline='always')
+def _laplacian_pixels(x_i, coefficients, l, i, n_channels):
+    h2 = _like(l, (1 / (l.shape[0] - 1)) ** 2)
+    up, mid, down = x_i[i], x_i[i + 1], x_i[i + 2]
+    mask, mask_n = coefficients[0, i], coefficients[2, i]
+
+    for j in range(l.shape[1]):
+        for c in range(n_channels):
+            l[i, j, c] = (
+                mask[j] * (up[j + 1, c] + mid[j, c] + mid[j + 2, c] + down[j + 1, c])
+                - mask_n[j] * mid[j + 1, c]
+            ) / h2
+
+
+_laplacian_rows = _rows(_laplacian_row, _laplacian_row_branchless, 1)
 
-            l[i, j] = (
-                x_i[i, j + 1]
-                + x_i[i + 1, j]
-                + x_i[i + 1, j + 2]
-                + x_i[i + 2, j + 1]
-                - n * x_i[i + 1, j + 1]
+
+@_kernel
+def _laplacian_sparse(x_i, unknowns, l):
+    h = _like(l, 1 / (l.shape[0] - 1))
+
+    for k in prange(unknowns.shape[0]):
+        i, j, n = unknowns[k, 0], unknowns[k, 1], _like(l, unknowns[k, 2])
+
+        for c in range(l.shape[2]):
+            l[i, j, c] = (
+                x_i[i, j + 1, c]
+                + x_i[i + 1, j, c]
+                + x_i[i + 1, j + 2, c]
+                + x_i[i + 2, j + 1, c]
+                - n * x_i[i + 1, j + 1, c]
             ) / h**2
 
     return l
 
 
+@_kernel
+def _dot(a, b):
+    s = 0.0
+
+    for i in prange(a.shape[0]):
+        for j in range(a.shape[1]):
+            for c in range(a.shape[2]):
+                s += a[i, j, c] * b[i, j, c]
+
+    return s
+
+
+@_kernel
+def _dot_channels(a, b):
+    a_b = np.zeros((a.shape[0], a.shape[2]))
+
+    for i in prange(a.shape[0]):
+        for j in range(a.shape[1]):
+            for c in range(a.shape[2]):
+                a_b[i, c] += a[i, j, c] * b[i, j, c]
+
+    return np.sum(a_b, axis=0)
+
+
+@_kernel
+def _direction(beta, z, p, mask, A_p, n_chunks):
+    """Conjugate gradient update p = z + beta * p fused with its Laplacian
+    A_p and p . A_p of each channel. Laplacian of row i - 1 is computed
+    right after row i of p is updated. Rows are split into chunks, the
+    first and the last row of a chunk need p from the neighbouring chunks,
+    so their Laplacian is computed after all chunks are updated."""
+    n_rows = z.shape[0]
+    p_A_p = np.zeros((n_chunks, z.shape[2]))
+
+    for k in prange(n_chunks):
+        start, end = _chunk(n_rows, n_chunks, k)
+        laplacian_start, laplacian_end = start + (k > 0), end - (end < n_rows)
+
+        for i in range(start, end + 1):
+            if i < end:
+                for j in range(z.shape[1]):
+                    for c in range(z.shape[2]):
+                        p[i + 1, j + 1, c] = z[i, j, c] + beta[c] * p[i + 1, j + 1, c]
+
+            if laplacian_start <= i - 1 < laplacian_end:
+                _laplacian_rows(p, mask, A_p, i - 1)
+                _dot_row(p, A_p, i - 1, p_A_p[k])
+
+    p_A_p_borders = np.zeros((n_chunks, z.shape[2]))
+
+    for k in prange(1, n_chunks):
+        start, _ = _chunk(n_rows, n_chunks, k)
+
+        for i in range(start - 1, start + 1):
+            _laplacian_rows(p, mask, A_p, i)
+            _dot_row(p, A_p, i, p_A_p_borders[k])
+
+    return np.sum(p_A_p, axis=0) + np.sum(p_A_p_borders, axis=0)
+
+
+@njit(inline='always')
+def _dot_row(a_pad, b, i, a_b):
+    for j in range(b.shape[1]):
+        for c in range(b.shape[2]):
+            a_b[c] += a_pad[i + 1, j + 1, c] * b[i, j, c]
+
+
+@_kernel
+def _direction_sparse(beta, z, p, unknowns):
+    for k in prange(unknowns.shape[0]):
+        i, j = unknowns[k, 0], unknowns[k, 1]
+
+        for c in range(z.shape[2]):
+            p[i + 1, j + 1, c] = z[i, j, c] + beta[c] * p[i + 1, j + 1, c]
+
+
+@_kernel
+def _update(alpha, p, A_p, x, r):
+    """x = x + alpha * p, r = r - alpha * A_p and r . r of each channel,
+    where p and x are padded."""
+    r_r = np.zeros((r.shape[0], r.shape[2]))
+
+    for i in prange(r.shape[0]):
+        for j in range(r.shape[1]):
+            for c in range(r.shape[2]):
+                x[i + 1, j + 1, c] += alpha[c] * p[i + 1, j + 1, c]
+                r[i, j, c] -= alpha[c] * A_p[i, j, c]
+                r_r[i, c] += r[i, j, c] ** 2
+
+    return np.sum(r_r, axis=0)
+
+
 class MultigridSolver(Solver):
     """Poisson's equation solver implemented using multigrid iteration."""
 
+    # Cycles run on the coarser grid to solve the correction equation
+    coarse_cycles = {'V': ('V',), 'W': ('W', 'W'), 'F': ('F', 'V')}
+
     def __init__(
         self,
         tol=1e-11,
@@ -330,73 +2018,1050 @@ class MultigridSolver(Solver):
         min_grid_size=2,
         n_smooth=20,
         n_solve=10,
-        eval=False,
+        n_post_smooth=None,
+        cycle='V',
+        fmg=False,
+        galerkin=False,
+        direct_solve=False,
+        semi_coarsening=False,
+        **kwargs,
     ):
         """Initialize multigrid solver parameters. Smoother is the solver
         used in the pre and post smoothing steps. Multigrid is recursively
         called to solve coarser grid problem. Problem on the smallest grid
         is directly solved.
 
+        Smoother and numbers of smoothing iterations can also be lists with
+        one value per grid starting from the finest one, the last value is
+        used for all the coarser grids.
+
         Parameters:
-            smoother: Solver
+            smoother: Solver or list of Solver
             min_grid_size: int
-            n_smooth: int ... number of smoothing iteration
+            n_smooth: int or list of int ... number of smoothing iteration
             n_solve: int ... number of iteration when doing direct solve
-            eval: bool ... if set True, solver is 'compiled' before every solve
+            n_post_smooth: int or list of int ... number of post smoothing
+                iterations, defaults to n_smooth
+            cycle: str ... 'V', 'W' or 'F' cycle
+            fmg: bool ... first iteration is full multigrid, which solves
+                the problem from the coarsest grid to the finest one and
+                uses interpolated coarse solutions as starting
+                approximations
+            galerkin: bool ... coarse grids use Galerkin operators built
+                from the restriction and prolongation, which account for
+                the boundary points covered by each coarse pixel instead
+                of making the whole coarse pixel a boundary point
+            direct_solve: bool ... problem on the smallest grid is solved
+                exactly using sparse LU factorization built once per
+                boundary mask instead of [n_solve] smoother iterations,
+                which makes larger min_grid_size viable
+            semi_coarsening: bool ... once the shorter side of a grid
+                reaches min_grid_size, keep coarsening only the longer one
+                until it reaches min_grid_size too, coarse grids with
+                different spacing of rows and columns use Galerkin
+                operators
         """
-        super().__init__(tol)
+        super().__init__(tol, **kwargs)
         if smoother is None:
-            smoother = SuccessiveOverRelaxationSolver(omega=1.7)
+            smoother = SuccessiveOverRelaxationSolver(omega=1.7, **kwargs)
+        smoothers = smoother if isinstance(smoother, (list, tuple)) else [smoother]
+        if any(smoother.planar != self.planar for smoother in smoothers):
+            raise ValueError('Smoother has to use the same image layout')
+        if any(
+            isinstance(smoother, ChebyshevJacobiSolver) and smoother.interval is None
+            for smoother in smoothers
+        ):
+            raise ValueError('Chebyshev smoother needs an interval, e.g. (0.3, 2)')
+        if any(
+            isinstance(smoother, SuccessiveOverRelaxationSolver) and smoother.adaptive
+            for smoother in smoothers
+        ):
+            raise ValueError('Adaptive omega is only updated by steps of solve')
+        if cycle not in self.coarse_cycles:
+            raise ValueError(f'Unknown cycle type {cycle}')
+        if fmg and (galerkin or semi_coarsening):
+            raise ValueError('Full multigrid cannot use Galerkin coarse grids')
 
         self.smoother = smoother
         self.min_grid_size = min_grid_size
         self.n_smooth = n_smooth
         self.n_solve = n_solve
-        self.eval = eval
-
-        _restriction(np.zeros((2, 2)))
+        self.n_post_smooth = n_smooth if n_post_smooth is None else n_post_smooth
+        self.cycle_type = cycle
+        self.fmg = fmg
+        self.galerkin = galerkin
+        self.direct_solve = direct_solve
+        self.semi_coarsening = semi_coarsening
+        self._levels = None
 
     def __repr__(self):
-        return f'MultigridSolver(n_smooth={self.n_smooth})'
-
-    def solve(self, x_i, f, points, verbose=False, save=None):
-        if self.eval:
-            boundary_m = np.ones(x_i.shape[:2])
-            self.iteration(x_i, f, boundary_m)
-        return super().solve(x_i, f, points, verbose, save)
+        fmg = ', fmg' if self.fmg else ''
+        return (
+            f'MultigridSolver({self.cycle_type}-cycle{fmg}, n_smooth={self.n_smooth})'
+        )
 
-    def iteration(self, x_i, f, boundary_m, iters=1):
+    def warm_up(self, n=8):
+        """Compile kernels on a problem large enough to have a coarser
+        grid than min_grid_size."""
+        super().warm_up(max(n, 2 * int(self.min_grid_size)))
+
+    def prepare(self, x_i, f, boundary_m):
+        """Allocate buffers of the coarser grids along with the levels built
+        for the boundary mask. Each grid also gets one smoother state,
+        which all of its smoothing steps reuse."""
+        state = super().prepare(x_i, f, boundary_m)
+        state.full_cycle = self.fmg
+        state.levels = self.levels(boundary_m)
+
+        # Corrections and right hand sides of the coarser grids
+        n_channels = f.shape[0] if self.planar else f.shape[2]
+        state.eps, state.rhs = [None], [None]
+        for level in state.levels[1:]:
+            shape = level.boundary_m.shape
+            shape = (n_channels, *shape) if self.planar else (*shape, n_channels)
+            state.eps.append(np.zeros(shape, dtype=f.dtype))
+            state.rhs.append(np.zeros(shape, dtype=f.dtype))
+
+        state.smoothing = []
+        for i, level in enumerate(state.levels):
+            x_level, f_level = (x_i, f) if i == 0 else (state.eps[i], state.rhs[i])
+            if level.stencil is None:
+                smoother = self._at_level(self.smoother, i)
+                smoothing = smoother.prepare(x_level, f_level, level.boundary_m)
+            else:
+                x_pad = self._pad(x_level)
+                smoothing = SolverState(x_pad, self._interior(x_pad), None)
+            state.smoothing.append(smoothing)
+
+        return state
+
+    def reset(self, state, x_i, f):
+        super().reset(state, x_i, f)
+        state.full_cycle = self.fmg
+
+    def levels(self, boundary_m):
+        """Build grid levels from [boundary_m] down to the coarsest grid.
+        Levels of the last mask are kept, so solves with the same points
+        reuse them."""
+        cached = self._levels
+        if cached is not None and np.array_equal(cached[0], boundary_m):
+            return cached[1]
+
+        levels = [MultigridLevel(boundary_m)]
+        spacing = 1 / (boundary_m.shape[0] - 1)
+
+        while True:
+            level = levels[-1]
+            level.factors = self._coarsening(level.boundary_m.shape)
+            if level.factors is None:
+                break
+
+            # Coarse pixels of grids not exactly halved are not evenly spaced
+            halved = level.factors == (2, 2) and not any(
+                n % 2 for n in level.boundary_m.shape
+            )
+            if self.galerkin or level.stencil is not None or not halved:
+                stencil = level.stencil
+                if stencil is None:
+                    stencil = self._kernel(_stencil)(level.boundary_m) / level.scale
+                stencil = self._kernel(_galerkin)(stencil, *level.factors)
+                boundary_restricted = np.where(stencil[4] < 0, 1.0, -1.0).astype(
+                    level.boundary_m.dtype
+                )
+                levels.append(MultigridLevel(boundary_restricted, stencil))
+            else:
+                boundary_restricted = self._restrict_mask(level.boundary_m)
+                spacing *= 2
+                scale = (spacing * (boundary_restricted.shape[0] - 1)) ** 2
+                levels.append(MultigridLevel(boundary_restricted, scale=scale))
+
+        coarsest = levels[-1]
+        if self.direct_solve and len(levels) > 1 and coarsest.pixels_to_solve:
+            stencil = coarsest.stencil
+            if stencil is None:
+                # Kernel spacing, the right-hand side is scaled to match it
+                stencil = self._kernel(_stencil)(coarsest.boundary_m)
+            coarsest.factorization = splu(_stencil_matrix(stencil))
+
+        self._levels = (boundary_m.copy(), levels)
+        return levels
+
+    def sweep(self, state, f, boundary_m, iters=1):
         """Implementation of multigrid iteration."""
-        return self.v_cycle(x_i, f, boundary_m)
+        for _ in range(iters):
+            if state.full_cycle:
+                state.full_cycle = False
+                state.x[...] = self.full_cycle(state, state.x, f)
+            else:
+                state.x[...] = self.cycle(state, state.x, f)
+
+    def full_cycle(self, state, x_i, f, level=0):
+        """Implementation of full multigrid. Problem is restricted to the
+        coarser grid, where boundary points take the average of the
+        boundary points they cover, and solved recursively. Its solution
+        interpolated to the pixels to solve is the starting approximation
+        of one cycle on this grid. Galerkin grids only hold the operator of
+        the correction equation, so a grid followed by one is solved by a
+        cycle from the restricted approximation. The coarsest grid is solved
+        exactly by the correction of its residual if direct_solve is set."""
+        boundary_m = state.levels[level].boundary_m
+        if level == len(state.levels) - 1:
+            if state.levels[level].factorization is None:
+                return self._interior(self.smooth(state, x_i, f, level, self.n_solve))
+
+            smoother = self._at_level(self.smoother, level)
+            smoothing = state.smoothing[level]
+            smoother.reset(smoothing, x_i, f)
+            r = smoother.update_residual(smoothing, f, boundary_m)
+            x_i += self.coarsest_solve(state, np.zeros_like(r), r, level)
+            return x_i
+        if state.levels[level + 1].stencil is not None:
+            return self.cycle(state, x_i, f, level)
+
+        known = self._unknown(boundary_m) == 0
+        known_restricted = self.restriction(known * np.ones_like(x_i))
+        x_restricted = self.restriction(x_i * known, state.eps[level + 1])
+        np.divide(
+            x_restricted,
+            known_restricted,
+            out=x_restricted,
+            where=known_restricted > 0,
+        )
+        f_restricted = self.restriction(f, state.rhs[level + 1])
+        self._rescale(state, f_restricted, level)
+
+        x_restricted = self.full_cycle(state, x_restricted, f_restricted, level + 1)
+        self.prolongation(x_restricted, boundary_m, x_i, add=False)
 
-    def v_cycle(self, x_i, f, boundary_m):
-        """Implementation of multigrid V-cycle."""
-        x_i = self.smoother.iteration(x_i, f, boundary_m, self.n_smooth)
+        return self.cycle(state, x_i, f, level)
 
-        r = self.residual(x_i, f, boundary_m)
-        rhs = _restriction(r)
+    def cycle(self, state, x_i, f, level=0, cycle=None):
+        """Implementation of multigrid V-cycle, W-cycle and F-cycle on grid
+        [level]. They differ in the cycles run on the coarser grid."""
+        if cycle is None:
+            cycle = self.cycle_type
+        boundary_m = state.levels[level].boundary_m
+
+        n_smooth = self._at_level(self.n_smooth, level)
+        x_pad = self.smooth(state, x_i, f, level, n_smooth)
+        x_i = self._interior(x_pad)
+
+        coarse = level + 1
+        if coarse < len(state.levels) and state.levels[coarse].pixels_to_solve:
+            rhs = self.residual_restriction(
+                x_pad, f, state.levels[level], state.rhs[coarse]
+            )
+            self._rescale(state, rhs, level)
+            eps = state.eps[coarse]
+            eps.fill(0)
 
-        eps = np.zeros_like(rhs)
-        boundary_restricted = _restriction(boundary_m)
-        pixels_to_solve = np.sum(boundary_restricted == 1)
+            if coarse == len(state.levels) - 1:
+                eps = self.coarsest_solve(state, eps, rhs, coarse)
+            else:
+                for coarse_cycle in self.coarse_cycles[cycle]:
+                    eps = self.cycle(state, eps, rhs, coarse, coarse_cycle)
+
+            self.prolongation(eps, boundary_m, x_i, factors=state.levels[level].factors)
+
+        n_post_smooth = self._at_level(self.n_post_smooth, level)
+        return self._interior(self.smooth(state, x_i, f, level, n_post_smooth))
+
+    def coarsest_solve(self, state, eps, rhs, level):
+        """Solve correction equation on the coarsest grid [level] starting
+        from zero eps. It is solved exactly with the factorization of the
+        level if direct_solve is set, otherwise approximately by n_solve
+        smoothing iterations."""
+        factorization = state.levels[level].factorization
+        if factorization is None:
+            return self._interior(self.smooth(state, eps, rhs, level, self.n_solve))
+
+        unknown = state.levels[level].boundary_m == 1
+        if self.planar:
+            eps[:, unknown] = factorization.solve(rhs[:, unknown].T).T
+        else:
+            eps[unknown] = factorization.solve(rhs[unknown])
+
+        return eps
+
+    def smooth(self, state, x_i, f, level, iters):
+        """Run [iters] smoothing iterations on grid [level] starting from
+        x_i and return the new approximation padded with zeros. Galerkin
+        coarse grids are smoothed by Gauss-Seidel iterations of their own
+        operator, other grids by the smoother. Returned array is the buffer
+        of the smoother state of the grid, valid until its next smoothing."""
+        boundary_m = state.levels[level].boundary_m
+        smoothing = state.smoothing[level]
+
+        if state.levels[level].stencil is None:
+            smoother = self._at_level(self.smoother, level)
+            smoother.reset(smoothing, x_i, f)
+            smoother.sweep(smoothing, f, boundary_m, iters)
+            smoother.finish(smoothing)
+            return smoothing.x_pad
+
+        smoothing.x[...] = x_i
+        for x_plane, f_plane in self._planes(smoothing.x_pad, f):
+            self._kernel(_stencil_iteration)(
+                x_plane, f_plane, state.levels[level].stencil, iters
+            )
 
-        if pixels_to_solve:
-            if eps.shape[0] <= self.min_grid_size:
-                eps = self.smoother.iteration(
-                    eps, rhs, boundary_restricted, self.n_solve
+        return smoothing.x_pad
+
+    def restriction(self, r, out=None, factors=(2, 2)):
+        """Restrict residual to the grid with resolution of rows and
+        columns divided by [factors], into [out] if given. Coarse pixels
+        average the pixels they cover, the last ones cover fewer pixels if
+        the size is not divisible."""
+        if out is None:
+            n, m = self._coarse_shape(self._shape(r), factors)
+            shape = (r.shape[0], n, m) if self.planar else (n, m, r.shape[2])
+            out = np.zeros(shape, dtype=r.dtype)
+
+        for r_plane, out_plane in self._planes(r, out):
+            self._kernel(_restriction)(r_plane, out_plane, *factors)
+
+        return out
+
+    def residual_restriction(self, x_pad, f, level, out):
+        """Compute residual of padded [x_pad] on grid [level] and restrict
+        it to the next coarser grid in one pass, without storing the
+        residual of this grid."""
+        for x_pad, f, out_plane in self._planes(x_pad, f, out):
+            if level.stencil is None:
+                self._kernel(_residual_restriction)(
+                    x_pad, f, level.boundary_m, out_plane, *level.factors
                 )
             else:
-                eps = self.v_cycle(eps, rhs, boundary_restricted)
+                self._kernel(_stencil_residual_restriction)(
+                    x_pad, f, level.stencil, out_plane, *level.factors
+                )
+
+        return out
+
+    def prolongation(self, eps, boundary_m, x_i, add=True, factors=(2, 2)):
+        """Interpolate correction to the grid with resolution of rows and
+        columns multiplied by [factors] and add it to the pixels to solve
+        of x_i in place. Boundary points are not corrected. If add is not
+        set, interpolated values replace the pixels to solve instead."""
+        for eps, x_i in self._planes(eps, x_i):
+            self._kernel(_prolongation)(eps, boundary_m, x_i, add, *factors)
+
+    @staticmethod
+    def _rescale(state, rhs, level):
+        """Scale right-hand side restricted from grid [level] in place from
+        the scale of that grid to the scale of the next coarser one."""
+        scale = state.levels[level + 1].scale / state.levels[level].scale
+        if scale != 1:
+            rhs *= scale
+
+    def _coarsening(self, shape):
+        """Factors by which rows and columns of a grid of [shape] are
+        coarsened, None if it is the coarsest grid."""
+        n, m = shape
+        if min(n, m) > self.min_grid_size:
+            return 2, 2
+        if self.semi_coarsening and max(n, m) > self.min_grid_size:
+            return (2, 1) if n > m else (1, 2)
+
+        return None
+
+    @staticmethod
+    def _coarse_shape(shape, factors):
+        """Shape of the grid coarser by [factors] than grid of [shape]."""
+        return tuple(-(-n // factor) for n, factor in zip(shape, factors))
+
+    def _restrict_mask(self, boundary_m):
+        """Boundary mask of the grid with half the resolution. Pixel is
+        solved only if all the pixels it covers are solved."""
+        shape = self._coarse_shape(boundary_m.shape, (2, 2))
+        boundary_restricted = np.zeros((*shape, 1), dtype=boundary_m.dtype)
+        self._kernel(_restriction)(
+            boundary_m[:, :, np.newaxis], boundary_restricted, 2, 2
+        )
+        return boundary_restricted[:, :, 0]
+
+    @staticmethod
+    def _at_level(value, level):
+        """Value of a per grid parameter for grid [level], which is either
+        the same for all grids or a list with the last value repeated."""
+        if not isinstance(value, (list, tuple)):
+            return value
+
+        return value[min(level, len(value) - 1)]
+
+
+class MultigridLevel:
+    """Boundary mask of one multigrid grid, its number of pixels to solve,
+    the 3x3 stencil of its operator when it is a Galerkin coarse grid,
+    factors by which its rows and columns are coarsened to the next grid
+    and factorization of the operator when the grid is solved directly.
+    Kernels take the spacing of a grid from its number of rows, which
+    differs from the real spacing of a coarse grid, so right-hand sides of
+    grids without a stencil are multiplied by scale = (real / kernel
+    spacing)^2. Levels depend only on the boundary mask, so they are shared
+    by all solves with the same points."""
+
+    def __init__(self, boundary_m, stencil=None, scale=1.0):
+        self.boundary_m = boundary_m
+        self.stencil = stencil
+        self.scale = scale
+        self.pixels_to_solve = np.sum(boundary_m == 1)
+        self.factors = None
+        self.factorization = None
+
+
+def _stencil_matrix(stencil):
+    """Sparse matrix of the operator given by (9, n, m) [stencil] acting on
+    the pixels to solve in row-major order, see _stencil."""
+    n, m = stencil.shape[1:]
+    unknown = stencil[4] != 0
+    index = np.full((n + 2, m + 2), -1)
+    index[1:-1, 1:-1][unknown] = np.arange(np.sum(unknown))
+
+    rows, cols, values = [], [], []
+    for o in range(9):
+        a, b = o // 3, o % 3
+        neighbours = index[a : a + n, b : b + m][unknown]
+        coefficients = stencil[o][unknown]
+        nonzero = (neighbours >= 0) & (coefficients != 0)
+
+        rows.append(index[1:-1, 1:-1][unknown][nonzero])
+        cols.append(neighbours[nonzero])
+        values.append(coefficients[nonzero])
+
+    size = np.sum(unknown)
+    return csc_matrix(
+        (np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(size, size),
+    )
+
+
+@_kernel
+def _restriction(r, r_restricted, a, b):
+    n, m = r.shape[0], r.shape[1]
+
+    for i in prange(r_restricted.shape[0]):
+        k_0, k_1 = _cover(i, a, n)
+
+        for j in range(r_restricted.shape[1]):
+            l_0, l_1 = _cover(j, b, m)
+            w = 1 / ((k_1 - k_0) * (l_1 - l_0))
+
+            for c in range(r.shape[2]):
+                r_ij = 0.0
+                for k in range(k_0, k_1):
+                    for l in range(l_0, l_1):
+                        r_ij += r[k, l, c]
+
+                r_restricted[i, j, c] = w * r_ij
+
+
+@_kernel
+def _residual_restriction(x_i, f, boundary_m, r_restricted, a, b):
+    h = _like(f, 1 / (f.shape[0] - 1))
+
+    for i in prange(r_restricted.shape[0]):
+        k_0, k_1 = _cover(i, a, f.shape[0])
+
+        for j in range(r_restricted.shape[1]):
+            l_0, l_1 = _cover(j, b, f.shape[1])
+            w = _like(f, 1 / ((k_1 - k_0) * (l_1 - l_0)))
+            r_restricted[i, j] = 0
+
+            for k in range(k_0, k_1):
+                n_vertical = (k > 0) + (k < f.shape[0] - 1)
+
+                for l in range(l_0, l_1):
+                    if boundary_m[k, l] < 1:
+                        continue
+
+                    n = _like(f, n_vertical + (l > 0) + (l < f.shape[1] - 1))
+
+                    for c in range(f.shape[2]):
+                        r_restricted[i, j, c] += w * (
+                            f[k, l, c]
+                            - (
+                                x_i[k, l + 1, c]
+                                + x_i[k + 1, l, c]
+                                + x_i[k + 1, l + 2, c]
+                                + x_i[k + 2, l + 1, c]
+                                - n * x_i[k + 1, l + 1, c]
+                            )
+                            / h**2
+                        )
 
-            correction = cv2.resize(eps, (x_i.shape[1], x_i.shape[0]))
-            correction[boundary_m < 1] = 0
-            x_i += correction
 
-        x_i = self.smoother.iteration(x_i, f, boundary_m, self.n_smooth)
+@_kernel
+def _prolongation(eps, boundary_m, x_i, add, a, b):
+    """Bilinear interpolation between centers of the coarse pixels, see
+    _interpolation. Rows (columns) which are not coarsened are copied."""
+    n_coarse, m_coarse = eps.shape[0], eps.shape[1]
 
-        return x_i
+    for i in prange(boundary_m.shape[0]):
+        i_0, i_1, w_i = _interpolation(i, a, n_coarse)
+
+        for j in range(boundary_m.shape[1]):
+            if boundary_m[i, j] < 1:
+                continue
+
+            j_0, j_1, w_j = _interpolation(j, b, m_coarse)
+
+            for c in range(x_i.shape[2]):
+                value = (1 - w_i) * (
+                    (1 - w_j) * eps[i_0, j_0, c] + w_j * eps[i_0, j_1, c]
+                ) + w_i * ((1 - w_j) * eps[i_1, j_0, c] + w_j * eps[i_1, j_1, c])
+
+                if add:
+                    x_i[i, j, c] += value
+                else:
+                    x_i[i, j, c] = value
+
+
+@njit
+def _cover(i, factor, n):
+    """First and last + 1 fine row covered by coarse row i, when rows are
+    coarsened by [factor]. The last coarse row of an odd number of rows
+    covers only one."""
+    return factor * i, min(factor * (i + 1), n)
 
 
 @njit
-def _restriction(r):
-    return 0.25 * (r[::2, ::2] + r[::2, 1::2] + r[1::2, ::2] + r[1::2, 1::2])
+def _interpolation(i, factor, n_coarse):
+    """Coarse rows i_0, i_1 interpolated to fine row i and weight w of
+    i_1. Coarsened by 2, the two nearest coarse rows are weighted by 3/4
+    and 1/4 and edges repeat the outermost coarse rows, otherwise coarse
+    row i is copied. Index of a parallel loop is unsigned, which would turn
+    the arithmetic into floats, so i is cast first."""
+    i = np.int64(i)
+    if factor == 1:
+        return i, i, 0.0
+
+    i_0 = (i - 1) // 2
+    w_i = 0.75 if i % 2 == 0 else 0.25
+    return max(i_0, 0), min(i_0 + 1, n_coarse - 1), w_i
+
+
+@_kernel
+def _stencil(boundary_m):
+    """Laplacian of the correction equation as a (9, n, m) array of 3x3
+    stencils, coefficient of neighbour (i + a, j + b) is at index
+    3 * (a + 1) + b + 1. Neighbours which are boundary points have zero
+    coefficient, since the correction is zero there. All coefficients of
+    boundary points are zero."""
+    n, m = boundary_m.shape
+    h = 1 / (n - 1)
+    stencil = np.zeros((9, n, m))
+
+    for i in prange(n):
+        for j in range(m):
+            if boundary_m[i, j] < 1:
+                continue
+
+            n_neighbours = (i > 0) + (i < n - 1) + (j > 0) + (j < m - 1)
+            stencil[4, i, j] = -n_neighbours / h**2
+            stencil[1, i, j] = (i > 0 and boundary_m[i - 1, j] == 1) / h**2
+            stencil[7, i, j] = (i < n - 1 and boundary_m[i + 1, j] == 1) / h**2
+            stencil[3, i, j] = (j > 0 and boundary_m[i, j - 1] == 1) / h**2
+            stencil[5, i, j] = (j < m - 1 and boundary_m[i, j + 1] == 1) / h**2
+
+    return stencil
+
+
+@_kernel
+def _galerkin(stencil, a, b):
+    """Galerkin operator R A P of the grid with rows and columns coarsened
+    by factors a and b, where R is the restriction averaging the pixels
+    covered by a coarse pixel and P the bilinear prolongation, which does
+    not correct boundary points. It is again a 3x3 stencil, which also
+    holds the different spacing of rows and columns of semi-coarsened
+    grids. Coarse pixels covering only boundary points have zero
+    coefficients."""
+    n, m = stencil.shape[1], stencil.shape[2]
+    n_coarse, m_coarse = -(-n // a), -(-m // b)
+    coarse = np.zeros((9, n_coarse, m_coarse))
+
+    for i in prange(n_coarse):
+        k_0, k_1 = _cover(i, a, n)
+
+        for j in range(m_coarse):
+            l_0, l_1 = _cover(j, b, m)
+            w = 1 / ((k_1 - k_0) * (l_1 - l_0))
+
+            for k in range(k_0, k_1):
+                for l in range(l_0, l_1):
+                    if stencil[4, k, l] == 0:
+                        continue
+
+                    for o in range(9):
+                        p, q = k + o // 3 - 1, l + o % 3 - 1
+                        if stencil[o, k, l] == 0 or stencil[4, p, q] == 0:
+                            continue
+
+                        p_0, p_1, w_p = _interpolation(p, a, n_coarse)
+                        q_0, q_1, w_q = _interpolation(q, b, m_coarse)
+
+                        for c_p in range(2):
+                            p_c = p_1 if c_p else p_0
+                            w_a = w_p if c_p else 1 - w_p
+
+                            for c_q in range(2):
+                                q_c = q_1 if c_q else q_0
+                                w_b = w_q if c_q else 1 - w_q
+
+                                coarse[3 * (p_c - i + 1) + q_c - j + 1, i, j] += (
+                                    w * stencil[o, k, l] * w_a * w_b
+                                )
+
+    return coarse
+
+
+@_kernel
+def _stencil_iteration(x_i, f, stencil, iters):
+    """Gauss-Seidel iterations with four colors, so that no two pixels of
+    the same color are neighbours in the 3x3 stencil."""
+    for _ in range(iters):
+        for color in range(4):
+            i_0, j_0 = color // 2, color % 2
+
+            for i_half in prange((f.shape[0] - i_0 + 1) // 2):
+                i = i_0 + 2 * i_half
+
+                for j in range(j_0, f.shape[1], 2):
+                    if stencil[4, i, j] == 0:
+                        continue
+
+                    for c in range(f.shape[2]):
+                        s = f[i, j, c]
+                        for o in range(9):
+                            if o != 4:
+                                s -= stencil[o, i, j] * x_i[i + o // 3, j + o % 3, c]
+
+                        x_i[i + 1, j + 1, c] = s / stencil[4, i, j]
+
+
+@_kernel
+def _stencil_residual_restriction(x_i, f, stencil, r_restricted, a, b):
+    for i in prange(r_restricted.shape[0]):
+        k_0, k_1 = _cover(i, a, f.shape[0])
+
+        for j in range(r_restricted.shape[1]):
+            l_0, l_1 = _cover(j, b, f.shape[1])
+            w = 1 / ((k_1 - k_0) * (l_1 - l_0))
+            r_restricted[i, j] = 0
+
+            for k in range(k_0, k_1):
+                for l in range(l_0, l_1):
+                    if stencil[4, k, l] == 0:
+                        continue
+
+                    for c in range(f.shape[2]):
+                        r_kl = f[k, l, c]
+                        for o in range(9):
+                            r_kl -= stencil[o, k, l] * x_i[k + o // 3, l + o % 3, c]
+
+                        r_restricted[i, j, c] += w * r_kl
+
+
+class MultigridConjugateGradientSolver(ConjugateGradientSolver):
+    """Poisson's equation solver implemented using conjugate gradient method
+    preconditioned by one multigrid cycle."""
+
+    def __init__(self, tol=1e-11, save_state=True, multigrid=None, **kwargs):
+        """Initialize multigrid used as the preconditioner. Its cycle solves
+        the equation for the preconditioned residual z starting from zero,
+        with the same number of pre and post smoothing iterations.
+
+        Parameters:
+            save_state: bool ... preserve state after each iteration
+            multigrid: MultigridSolver ... defaults to V-cycle with 4
+                smoothing iterations
+        """
+        super().__init__(tol, save_state, **kwargs)
+        if multigrid is None:
+            multigrid = MultigridSolver(n_smooth=4, **kwargs)
+        if multigrid.planar != self.planar:
+            raise ValueError('Multigrid has to use the same image layout')
+
+        self.preconditioner = 'multigrid'
+        self.multigrid = multigrid
+
+    def __repr__(self):
+        return f'MultigridConjugateGradientSolver({self.multigrid})'
+
+    def warm_up(self, n=8):
+        """Compile kernels on a problem large enough to have a coarser
+        grid than min_grid_size of the multigrid."""
+        super().warm_up(max(n, 2 * int(self.multigrid.min_grid_size)))
+
+    def prepare(self, x_i, f, boundary_m):
+        """Allocate preconditioned residual and the multigrid state, which
+        holds the buffers of the coarser grids."""
+        state = super().prepare(x_i, f, boundary_m)
+        state.z = np.zeros_like(f)
+        state.multigrid = self.multigrid.prepare(state.z, f, boundary_m)
+        return state
+
+    def precondition(self, state, r):
+        """Run one multigrid cycle on the equation nabla^2 z = r with zero
+        on the boundary points, starting from zero z."""
+        z = state.z
+        z.fill(0)
+        z[...] = self.multigrid.cycle(state.multigrid, z, r)
+        return z
+
+
+class DirectSolver(Solver):
+    """Poisson's equation solver implemented using sparse LU factorization
+    of the matrix of pixels to solve."""
+
+    def __init__(self, tol=1e-11, cache_size=8, cache_dir=None, **kwargs):
+        """Initialize cache of factorizations. Factorization depends only on
+        the boundary mask, so images sharing points are solved by triangular
+        solves with the cached one.
+
+        Parameters:
+            cache_size: int ... number of factorizations kept in memory,
+                least recently used one is dropped first
+            cache_dir: str ... directory where factorizations are saved
+                and loaded from, None keeps them only in memory
+        """
+        super().__init__(tol, **kwargs)
+        self.cache_size = cache_size
+        self.cache_dir = cache_dir
+        self._factorizations = OrderedDict()
+        self._lock = Lock()
+
+    def __repr__(self):
+        return 'DirectSolver()'
+
+    def prepare(self, x_i, f, boundary_m):
+        """Get factorization for the boundary mask."""
+        state = super().prepare(x_i, f, boundary_m)
+        state.unknown = boundary_m == 1
+        state.factorization = self.factorization(boundary_m)
+        return state
+
+    def sweep(self, state, f, boundary_m, iters=1):
+        """Solve the equation for the correction of pixels to solve, whose
+        right-hand side is the residual. All channels are solved at once as
+        multiple right-hand sides. First iteration gives the solution,
+        further ones refine it."""
+        if state.factorization is None:
+            return
+
+        for _ in range(iters):
+            r = self.update_residual(state, f, boundary_m)
+
+            if self.planar:
+                state.x[:, state.unknown] += state.factorization.solve(
+                    r[:, state.unknown].T
+                ).T
+            else:
+                state.x[state.unknown] += state.factorization.solve(r[state.unknown])
+
+    def factorization(self, boundary_m):
+        """Factorization of the matrix of pixels to solve of [boundary_m],
+        None if there are no pixels to solve. It is taken from the memory
+        cache, then from the cache directory, and only factorized if it is
+        in neither of them. Cache is locked only while it is read or
+        updated, so concurrent solves may factorize the same mask twice."""
+        if not np.any(boundary_m == 1):
+            return None
+
+        key = self._key(boundary_m)
+        with self._lock:
+            factorization = self._factorizations.get(key)
+
+        if factorization is None and self.cache_dir is not None:
+            filename = path.join(self.cache_dir, f'{key}.npz')
+            if path.exists(filename):
+                factorization = Factorization.load(filename)
+
+        if factorization is None:
+            stencil = self._kernel(_stencil)(boundary_m)
+            factorization = Factorization.factorize(_stencil_matrix(stencil))
+
+            if self.cache_dir is not None:
+                makedirs(self.cache_dir, exist_ok=True)
+                factorization.save(path.join(self.cache_dir, f'{key}.npz'))
+
+        with self._lock:
+            self._factorizations[key] = factorization
+            self._factorizations.move_to_end(key)
+            while len(self._factorizations) > self.cache_size:
+                self._factorizations.popitem(last=False)
+
+        return factorization
+
+
+class Factorization:
+    """LU factorization P_r A P_c = L U of sparse matrix A. SuperLU objects
+    cannot be saved to disk, so their factors are saved instead and loaded
+    factorization solves the system by triangular solves of the factors."""
+
+    def __init__(self, lu=None, factors=None):
+        """Wrap SuperLU object [lu] or factors (L, U, perm_r, perm_c) with
+        L and U in CSR format."""
+        self.lu = lu
+        self.factors = factors
+
+    @classmethod
+    def factorize(cls, A):
+        return cls(lu=splu(A))
+
+    def solve(self, b):
+        """Solve A x = b for (n, k) array b with k right-hand sides."""
+        if self.lu is not None:
+            return self.lu.solve(b)
+
+        L, U, perm_r, perm_c = self.factors
+        x = np.empty_like(b)
+        x[perm_r] = b
+        _triangular_solve(L.indptr, L.indices, L.data, x, True)
+        _triangular_solve(U.indptr, U.indices, U.data, x, False)
+        return x[perm_c]
+
+    def save(self, filename):
+        """Save factors to [filename]. They are written to a temporary file
+        which then replaces it, so concurrent loads never read a partially
+        written file."""
+        if self.factors is None:
+            L, U = self.lu.L.tocsr(), self.lu.U.tocsr()
+            perm_r, perm_c = self.lu.perm_r, self.lu.perm_c
+        else:
+            L, U, perm_r, perm_c = self.factors
+
+        fd, temp_filename = mkstemp(suffix='.npz', dir=path.dirname(filename))
+        try:
+            with open(fd, 'wb') as f:
+                np.savez(
+                    f,
+                    L_data=L.data,
+                    L_indices=L.indices,
+                    L_indptr=L.indptr,
+                    U_data=U.data,
+                    U_indices=U.indices,
+                    U_indptr=U.indptr,
+                    perm_r=perm_r,
+                    perm_c=perm_c,
+                )
+            replace(temp_filename, filename)
+        except BaseException:
+            remove(temp_filename)
+            raise
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as f:
+            shape = (len(f['perm_r']),) * 2
+            L = csr_matrix((f['L_data'], f['L_indices'], f['L_indptr']), shape)
+            U = csr_matrix((f['U_data'], f['U_indices'], f['U_indptr']), shape)
+            return cls(factors=(L, U, f['perm_r'], f['perm_c']))
+
+
+@njit(cache=True, nogil=True)
+def _triangular_solve(indptr, indices, data, b, lower):
+    """Solve triangular system given by CSR matrix in place of (n, k)
+    array b. Rows of lower triangular matrix are solved from the first one,
+    rows of upper triangular one from the last one."""
+    n = b.shape[0]
+
+    for k in range(n):
+        i = k if lower else n - 1 - k
+        diagonal = 1.0
+
+        for e in range(indptr[i], indptr[i + 1]):
+            j = indices[e]
+
+            if j == i:
+                diagonal = data[e]
+            else:
+                for c in range(b.shape[1]):
+                    b[i, c] -= data[e] * b[j, c]
+
+        for c in range(b.shape[1]):
+            b[i, c] /= diagonal
+
+
+class AndersonSolver(Solver):
+    """Anderson acceleration of a stationary iteration x_{k+1} = G(x_k),
+    e.g. Jacobi, SOR or multigrid cycles of the wrapped solver."""
+
+    def __init__(self, solver, tol=1e-11, depth=10, mixing=1.0, **kwargs):
+        """Initialize Anderson mixing of the last [depth] iterates of
+        [solver]. Iterations of the wrapped solver are run unchanged, only
+        the next approximation is extrapolated from their history.
+
+        Parameters:
+            solver: Solver ... stationary iteration to accelerate
+            depth: int ... number of previous iterates used, history takes
+                2 * depth times the memory of the image
+            mixing: float in (0, 1] ... fraction of the fixed-point
+                residual added to the extrapolated approximation
+        """
+        super().__init__(tol, **kwargs)
+        if isinstance(solver, (ConjugateGradientSolver, ChebyshevJacobiSolver)):
+            raise ValueError('Only stationary iterations can be accelerated')
+        if getattr(solver, 'split', False):
+            raise ValueError('Split layout keeps approximation out of x')
+        if getattr(solver, 'adaptive', False):
+            raise ValueError('Adaptive omega is only updated by steps of solve')
+        if solver.planar != self.planar:
+            raise ValueError('Solver has to use the same image layout')
+
+        self.solver = solver
+        self.depth = depth
+        self.mixing = mixing
+
+    def __repr__(self):
+        return f'AndersonSolver({self.solver}, depth={self.depth})'
+
+    def warm_up(self, n=8):
+        """Compile kernels of the wrapped solver along with the ones of
+        Anderson mixing."""
+        self.solver.warm_up(n)
+        super().warm_up(n)
+
+    def prepare(self, x_i, f, boundary_m):
+        """Prepare the wrapped solver and allocate history of the iterates.
+        Differences of the last [depth] iterates and of their fixed-point
+        residuals are kept in ring buffers of shape (depth, ...), along
+        with the Gram matrix of the residual differences of each channel,
+        so each iteration only replaces the oldest entry and its row and
+        column of the Gram matrix."""
+        state = self.solver.prepare(x_i, f, boundary_m)
+
+        n_channels = f.shape[0] if self.planar else f.shape[2]
+        state.x_k = state.x.copy()
+        state.y_prev, state.g_prev = np.empty_like(f), np.empty_like(f)
+        state.dy = np.empty((self.depth, *f.shape), dtype=f.dtype)
+        state.dg = np.empty((self.depth, *f.shape), dtype=f.dtype)
+        state.gram = np.zeros((n_channels, self.depth, self.depth))
+        state.n_history, state.slot, state.previous = 0, 0, False
+
+        return state
+
+    def reset(self, state, x_i, f):
+        self.solver.reset(state, x_i, f)
+        state.x_k[...] = x_i
+        state.n_history, state.slot, state.previous = 0, 0, False
+
+    def finish(self, state):
+        self.solver.finish(state)
+
+    def update_residual(self, state, f, boundary_m, r=None):
+        return self.solver.update_residual(state, f, boundary_m, r)
+
+    def sweep(self, state, f, boundary_m, iters=1):
+        """Implementation of Anderson mixing. With fixed-point residuals
+        g_k = G(x_k) - x_k and differences dx_i = x_{i+1} - x_i and
+        dg_i = g_{i+1} - g_i of the last iterates, coefficients gamma
+        minimize |g_k - dg gamma| and
+
+        x_{k+1} = x_k + beta * g_k - (dx + beta * dg) gamma
+
+        where beta is the mixing. History keeps dy = dx + beta * dg, the
+        differences of y_k = x_k + beta * g_k. Channels are independent
+        problems, each has its own coefficients."""
+        for _ in range(iters):
+            self.solver.sweep(state, f, boundary_m)
+
+            slot = state.slot
+            if state.previous:
+                state.n_history = min(state.n_history + 1, self.depth)
+            n = state.n_history
+
+            column, rhs = [], []
+            for x, x_k, y_prev, g_prev, dy, dg in self._history_planes(state):
+                column_c, rhs_c = self._kernel(_anderson_history)(
+                    x, x_k, y_prev, g_prev, dy, dg, self.mixing, state.previous, slot, n
+                )
+                column.append(column_c)
+                rhs.append(rhs_c)
+            column, rhs = np.concatenate(column, 1), np.concatenate(rhs, 1)
+
+            if state.previous:
+                state.gram[:, :n, slot] = column.T
+                state.gram[:, slot, :n] = column.T
+                state.slot = (slot + 1) % self.depth
+            state.previous = True
+
+            gamma = np.zeros((n, rhs.shape[1]))
+            if n:
+                gram_inv = np.linalg.pinv(
+                    state.gram[:, :n, :n], rcond=1e-10, hermitian=True
+                )
+                gamma = (gram_inv @ rhs.T[:, :, np.newaxis])[:, :, 0].T
+
+            for c, (x, x_k, _, _, dy, _) in enumerate(self._history_planes(state)):
+                gamma_c = gamma[:, c : c + 1] if self.planar else gamma
+                self._kernel(_anderson_update)(gamma_c, dy, x_k, x)
+
+    def _history_planes(self, state):
+        """Planes of the approximation, history buffers and ring buffers
+        passed to the kernels, which index pixels as [i, j, c]."""
+        images = (state.x, state.x_k, state.y_prev, state.g_prev)
+        if not self.planar:
+            return [(*images, state.dy, state.dg)]
+
+        return [
+            (
+                *planes,
+                state.dy[:, c, :, :, np.newaxis],
+                state.dg[:, c, :, :, np.newaxis],
+            )
+            for c, planes in enumerate(self._planes(*images))
+        ]
+
+
+@_kernel
+def _anderson_history(x, x_k, y_prev, g_prev, dy, dg, mixing, previous, slot, n):
+    """Fixed-point residual g = x - x_k of the new iterate x, differences
+    of y = x_k + mixing * g and g from the previous iteration stored into
+    [slot] of the ring buffers and y stored into x_k. Returns dot products
+    of the first [n] residual differences with the new one, which form
+    the new column of the Gram matrix, and with g, for each channel."""
+    n_rows, n_channels = x.shape[0], x.shape[2]
+    column = np.zeros((n_rows, n, n_channels))
+    rhs = np.zeros((n_rows, n, n_channels))
+
+    for i in prange(n_rows):
+        for j in range(x.shape[1]):
+            for c in range(n_channels):
+                g = x[i, j, c] - x_k[i, j, c]
+                y = x_k[i, j, c] + mixing * g
+
+                if previous:
+                    dy[slot, i, j, c] = y - y_prev[i, j, c]
+                    dg[slot, i, j, c] = g - g_prev[i, j, c]
+
+                y_prev[i, j, c] = y
+                g_prev[i, j, c] = g
+                x_k[i, j, c] = y
+
+        # Without the previous iteration, the history is empty
+        for s in range(n):
+            for c in range(n_channels):
+                dg_dg, dg_g = 0.0, 0.0
+                for j in range(x.shape[1]):
+                    dg_dg += dg[s, i, j, c] * dg[slot, i, j, c]
+                    dg_g += dg[s, i, j, c] * g_prev[i, j, c]
+
+                column[i, s, c] = dg_dg
+                rhs[i, s, c] = dg_g
+
+    return np.sum(column, axis=0), np.sum(rhs, axis=0)
+
+
+@_kernel
+def _anderson_update(gamma, dy, x_k, x):
+    """x_k = x_k - dy gamma, copied into x."""
+    for i in prange(x.shape[0]):
+        for j in range(x.shape[1]):
+            for c in range(x.shape[2]):
+                x_kc = x_k[i, j, c]
+                for s in range(gamma.shape[0]):
+                    x_kc -= gamma[s, c] * dy[s, i, j, c]
+
+                x_k[i, j, c] = x_kc
+                x[i, j, c] = x_kc
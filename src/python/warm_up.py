@@ -0,0 +1,69 @@
+from time import time
+
+import numpy as np
+
+from solvers import (
+    JacobiSolver,
+    ChebyshevJacobiSolver,
+    SuccessiveOverRelaxationSolver,
+    ConjugateGradientSolver,
+    MultigridSolver,
+    DirectSolver,
+    AndersonSolver,
+)
+
+SOLVERS = (
+    JacobiSolver,
+    ChebyshevJacobiSolver,
+    SuccessiveOverRelaxationSolver,
+    ConjugateGradientSolver,
+    MultigridSolver,
+    DirectSolver,
+)
+OPTIONS = (
+    {},
+    {'branchless': True},
+    {'sparse': True},
+    {'planar': True},
+    {'planar': True, 'branchless': True},
+    {'dtype': np.float32},
+    {'dtype': np.float32, 'branchless': True},
+)
+
+
+def main():
+    """Compile kernels of all solvers and their options ahead of time. They
+    are cached on disk, so later processes start solving without compiling
+    them again."""
+    start = time()
+
+    for parallel in (False, True):
+        for solver_cls in SOLVERS:
+            for options in OPTIONS:
+                warm_up(solver_cls(parallel=parallel, **options), options)
+
+        for solver_cls in (JacobiSolver, SuccessiveOverRelaxationSolver):
+            for options in ({'tile_sweeps': 2}, {'tile_sweeps': 2, 'branchless': True}):
+                warm_up(solver_cls(parallel=parallel, **options), options)
+
+        options = {'split': True}
+        warm_up(SuccessiveOverRelaxationSolver(parallel=parallel, **options), options)
+
+        for options in ({'galerkin': True}, {'direct_solve': True}):
+            warm_up(MultigridSolver(parallel=parallel, **options), options)
+
+        for options in ({}, {'planar': True}):
+            solver = JacobiSolver(parallel=parallel, **options)
+            warm_up(AndersonSolver(solver, parallel=parallel, **options), options)
+
+    print(f'Done in {time() - start:.2f} s')
+
+
+def warm_up(solver, options):
+    start = time()
+    solver.warm_up()
+    print(f'{solver}, parallel={solver.parallel}, {options}: {time() - start:.2f} s')
+
+
+if __name__ == '__main__':
+    main()